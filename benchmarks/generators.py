@@ -0,0 +1,176 @@
+import random
+from typing import Any
+
+# 제주도 본섬을 감싸는 영역 (경도, 위도)
+LONGITUDE = (126.16, 126.95)
+LATITUDE = (33.20, 33.55)
+
+# wave 1 시작 시각 (2023-08-23 08:00 KST)
+WAVE_1_START = 1692745200
+
+def Location(rnd: random.Random) -> tuple[float, float]:
+    return (round(rnd.uniform(*LONGITUDE), 6), round(rnd.uniform(*LATITUDE), 6))
+
+def Grid(count: int) -> list[tuple[float, float, float, float]]:
+    """
+    제주도 영역을 경도 방향으로 `count`개로 나눈 (x0, x1, y0, y1) 영역들
+    """
+    width = (LONGITUDE[1] - LONGITUDE[0]) / count
+    return [
+        (LONGITUDE[0] + width * i, LONGITUDE[0] + width * (i + 1), LATITUDE[0], LATITUDE[1])
+        for i in range(count)
+    ]
+
+def Boundaries(ids: list[str]) -> list[dict]:
+    return [
+        { 'id': id, 'polygon': [ (x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0) ] }
+        for id, (x0, x1, y0, y1) in zip(ids, Grid(len(ids)))
+    ]
+
+def V1Request(
+        works: int = 40,
+        vehicles: int = 4,
+        assemblies: int = 2,
+        groups: int = 4,
+        seed: int = 0,
+        algorithm: dict | None = None,
+        ) -> dict[str, Any]:
+    """
+    `/v1/jeju_onul` request (`current_status=wait`)
+
+    차량 i는 집결지 `i % assemblies`에서 출발하여 wave 1, 2 모두 집결지 0으로 모인다.
+    """
+    rnd = random.Random(seed)
+
+    group_ids = [ f'G{i}' for i in range(groups) ]
+
+    assembly_list = [ { 'id': i, 'location': Location(rnd) } for i in range(assemblies) ]
+
+    vehicle_list = [
+        { 'id': i, 'location': assembly_list[i % assemblies]['location'] }
+        for i in range(vehicles)
+    ]
+
+    work_list = [
+        {
+            'id': i,
+            'pickup': { 'location': Location(rnd), 'group': rnd.choice(group_ids), 'setup_time': 60, 'service_time': 30 },
+            'delivery': { 'location': Location(rnd), 'group': rnd.choice(group_ids), 'setup_time': 60, 'service_time': 30 },
+            'status': { 'type': 'waiting' },
+        }
+        for i in range(works)
+    ]
+
+    def schedule(i: int, wave: int) -> dict:
+        return {
+            'id': i,
+            'from_assembly_id': i % assemblies if wave == 1 else 0,
+            'to_assembly_id': 0,
+            'group': group_ids[i % groups],
+            'tasks': [],
+        }
+
+    request = {
+        'current_time': WAVE_1_START - 600,
+        'current_status': 'wait',
+        'vehicles': vehicle_list,
+        'works': work_list,
+        'assemblies': assembly_list,
+        'schedules': {
+            'wave_1': { 'start': WAVE_1_START, 'end': WAVE_1_START + 13500, 'vehicles': [ schedule(i, 1) for i in range(vehicles) ] },
+            'wave_2': { 'start': WAVE_1_START + 18000, 'vehicles': [ schedule(i, 2) for i in range(vehicles) ] },
+            'wave_3': { 'vehicles': [ { k: v for k, v in schedule(i, 3).items() if k != 'to_assembly_id' } for i in range(vehicles) ] },
+        },
+    }
+
+    if algorithm is not None:
+        request['algorithm'] = algorithm
+
+    return request
+
+def V2Request(
+        works: int = 40,
+        vehicles: int = 4,
+        assemblies: int = 2,
+        boundaries: int = 4,
+        seed: int = 0,
+        shipped: int = 0,
+        ) -> dict[str, Any]:
+    """
+    `/v2/jeju_onul_before`, `/v2/jeju_onul_after` request
+
+    차량 i는 권역 `i % boundaries`를 담당하고 다음 권역을 제외한다. 앞의 `shipped`개 주문은 이미 실은 상태이다.
+    """
+    rnd = random.Random(seed)
+
+    boundary_ids = [ f'{chr(ord("A") + i % 26)}-{i // 26}' for i in range(boundaries) ]
+    vehicle_ids = [ f'v{i}' for i in range(vehicles) ]
+
+    work_list = []
+    for i in range(works):
+        work = { 'id': f'w{i}', 'pickup': { 'location': Location(rnd) }, 'delivery': { 'location': Location(rnd) } }
+        if i < shipped:
+            work['status'] = { 'type': 'shipped', 'vehicle_id': vehicle_ids[i % vehicles] }
+        work_list.append(work)
+
+    # 같은 위치의 pickup (duplicated setup time)
+    if works > 1:
+        work_list[1]['pickup']['location'] = work_list[0]['pickup']['location']
+
+    return {
+        'current_time': '2024-01-25T11:11:46+09:00',
+        'works': work_list,
+        'vehicles': [
+            {
+                'id': id,
+                'current_location': Location(rnd),
+                'include': [ boundary_ids[i % boundaries] ],
+                'exclude': [ boundary_ids[(i + 1) % boundaries] ] if boundaries > 1 else [],
+            }
+            for i, id in enumerate(vehicle_ids)
+        ],
+        'assemblies': [ { 'id': f'hub-{i}', 'location': Location(rnd) } for i in range(assemblies) ],
+        'boundaries': Boundaries(boundary_ids),
+    }
+
+def AutoPilotRequest(works: int = 40, seed: int = 0) -> dict[str, Any]:
+    """
+    `/v2/auto_pilot` request
+
+    auto pilot은 권역(A-1, B-0, C-0, D-0), 집결지(오등동센터, 중문동, 공항동)와 기사 4명이 정해져 있으므로 주문 수만 바꿀 수 있다.
+    """
+    rnd = random.Random(seed)
+
+    boundary_ids = [ 'A-1', 'B-0', 'C-0', 'D-0' ]
+    vehicle_ids = [ '기사 A', '기사 B', '기사 C', '기사 D' ]
+
+    return {
+        'current_time': '2024-01-25T11:11:46+09:00',
+        'works': [
+            { 'id': f'w{i}', 'pickup': { 'location': Location(rnd) }, 'delivery': { 'location': Location(rnd) } }
+            for i in range(works)
+        ],
+        'vehicles': [
+            {
+                'id': id,
+                'current_location': Location(rnd),
+                'include': [ boundary_ids[i] ],
+                'exclude': [ boundary_ids[(i + 1) % 4] ],
+            }
+            for i, id in enumerate(vehicle_ids)
+        ],
+        'assemblies': [
+            { 'id': '오등동센터', 'location': (126.53, 33.47) },
+            { 'id': '중문동', 'location': (126.41, 33.25) },
+            { 'id': '공항동', 'location': (126.49, 33.50) },
+        ],
+        'boundaries': [
+            { 'id': id, 'polygon': [ (x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0) ] }
+            for id, (x0, x1, y0, y1) in zip(boundary_ids, [
+                (126.15, 126.55, 33.38, 33.56),
+                (126.55, 126.96, 33.38, 33.56),
+                (126.15, 126.55, 33.19, 33.38),
+                (126.55, 126.96, 33.19, 33.38),
+            ])
+        ],
+    }
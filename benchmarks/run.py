@@ -0,0 +1,274 @@
+"""
+local stub server(vroouty, OSRM)를 띄우고 API를 in-process로 호출하여 성능을 측정한다.
+
+    python -m benchmarks.run --works 200 --vehicles 8 --iterations 20
+    python -m benchmarks.run --endpoints v1 --latency 0.05 --output v1.json
+
+endpoint별로 latency percentile, request당 upstream 호출 수, CPU 시간과
+profile한 request들의 함수별(stage) 누적 CPU 시간을 출력한다.
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import math
+import os
+import pstats
+import time
+from typing import Any, Callable
+
+from benchmarks.generators import AutoPilotRequest, V1Request, V2Request
+from benchmarks.stubs import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (path, request generator)
+ENDPOINTS: dict[str, tuple[str, Callable[[argparse.Namespace, int], dict]]] = {
+    'v1': (
+        '/v1/jeju_onul',
+        lambda args, seed: V1Request(args.works, args.vehicles, args.assemblies, args.boundaries, seed),
+    ),
+    'v2_before': (
+        '/v2/jeju_onul_before',
+        lambda args, seed: V2Request(args.works, args.vehicles, args.assemblies, args.boundaries, seed),
+    ),
+    'v2_after': (
+        '/v2/jeju_onul_after',
+        lambda args, seed: V2Request(args.works, args.vehicles, args.assemblies, args.boundaries, seed, shipped=args.works // 5),
+    ),
+    'auto_pilot': (
+        '/v2/auto_pilot',
+        lambda args, seed: AutoPilotRequest(args.works, seed),
+    ),
+}
+
+async def Call(app, path: str, body: dict) -> tuple[int, bytes]:
+    """
+    HTTP server 없이 ASGI app에 POST request를 전달하고 (status, body)를 반환한다.
+    """
+    content = json.dumps(body, ensure_ascii=False).encode()
+
+    scope = {
+        'type': 'http',
+        'asgi': { 'version': '3.0' },
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [
+            (b'host', b'benchmark'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(content)).encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('benchmark', 80),
+    }
+
+    sent = False
+    finished = asyncio.Event()
+
+    async def receive() -> dict:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return { 'type': 'http.request', 'body': content, 'more_body': False }
+
+        # 응답이 끝난 후에 연결이 끊어진 것으로 처리
+        await finished.wait()
+        return { 'type': 'http.disconnect' }
+
+    status = 0
+    chunks: list[bytes] = []
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                finished.set()
+
+    await app(scope, receive, send)
+
+    return status, b''.join(chunks)
+
+def Percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+def Stages(profiler: cProfile.Profile, requests: int, top: int) -> list[tuple[str, float, float]]:
+    """
+    repo의 함수별 (이름, request당 누적 CPU 시간, request당 자체 CPU 시간), 누적 시간 순
+
+    `asyncio.gather` 등으로 만든 task에서 실행된 시간은 호출한 함수가 아닌 task의 함수에만 누적된다.
+    """
+    stages = []
+
+    for (filename, line, function), (_, _, own, cumulative, _) in pstats.Stats(profiler).stats.items():
+        # built-in 함수
+        if filename == '~':
+            continue
+
+        filename = os.path.abspath(filename)
+        if not filename.startswith(ROOT + os.sep) or filename.startswith(os.path.join(ROOT, 'benchmarks')):
+            continue
+
+        name = f'{os.path.relpath(filename, ROOT)}:{line}({function})'
+        stages.append((name, cumulative / requests, own / requests))
+
+    stages.sort(key=lambda s: -s[1])
+
+    return stages[:top]
+
+async def Benchmark(app, stubs: StubServer, name: str, args: argparse.Namespace) -> dict[str, Any]:
+    from dependencies.cache import caches
+
+    path, generate = ENDPOINTS[name]
+
+    def request(i: int) -> dict:
+        # warm: 같은 request를 반복하여 cache hit 경로를 측정, 그 외에는 매번 cache를 비운 다른 request
+        if args.warm:
+            return generate(args, args.seed)
+
+        for cache in caches.values():
+            cache.clear()
+
+        return generate(args, args.seed + i)
+
+    for i in range(args.warmup):
+        await Call(app, path, request(-1 - i))
+
+    latencies: list[float] = []
+    cpu_times: list[float] = []
+    counts: dict[str, int] = { k: 0 for k in stubs.counts }
+    errors: dict[int, int] = {}
+
+    for i in range(args.iterations):
+        body = request(i)
+        stubs.reset()
+
+        cpu = time.thread_time()
+        start = time.perf_counter()
+
+        status, _ = await Call(app, path, body)
+
+        latencies.append(time.perf_counter() - start)
+        cpu_times.append(time.thread_time() - cpu)
+
+        for k, v in stubs.reset().items():
+            counts[k] += v
+
+        if status != 200:
+            errors[status] = errors.get(status, 0) + 1
+
+    # stub server는 다른 thread에서 실행되므로 thread_time에는 API의 CPU 시간만 포함된다
+    profiler = cProfile.Profile(time.thread_time)
+
+    for i in range(args.profile):
+        body = request(i)
+
+        profiler.enable()
+        await Call(app, path, body)
+        profiler.disable()
+
+    return {
+        'endpoint': name,
+        'path': path,
+        'iterations': args.iterations,
+        'latency': {
+            'p50': Percentile(latencies, 50),
+            'p90': Percentile(latencies, 90),
+            'p99': Percentile(latencies, 99),
+            'max': max(latencies),
+            'mean': sum(latencies) / len(latencies),
+        },
+        'cpu': sum(cpu_times) / len(cpu_times),
+        'upstream': { k: v / args.iterations for k, v in counts.items() },
+        'errors': errors,
+        'stages': [
+            { 'name': stage, 'cumulative': cumulative, 'own': own }
+            for stage, cumulative, own in (Stages(profiler, args.profile, args.top) if args.profile > 0 else [])
+        ],
+    }
+
+def Report(result: dict[str, Any]) -> None:
+    latency = result['latency']
+
+    print(f"{result['endpoint']} ({result['path']}, {result['iterations']} requests)")
+    print(
+        f"  latency   p50 {latency['p50']:.3f}s  p90 {latency['p90']:.3f}s  p99 {latency['p99']:.3f}s"
+        f"  max {latency['max']:.3f}s  mean {latency['mean']:.3f}s"
+    )
+    print(f"  cpu       {result['cpu']:.3f}s / request")
+    print('  upstream  ' + '  '.join(f'{k} {v:.1f}' for k, v in result['upstream'].items()) + ' / request')
+
+    if len(result['errors']) > 0:
+        print('  errors    ' + '  '.join(f'{status}: {count}' for status, count in result['errors'].items()))
+
+    if len(result['stages']) > 0:
+        print('  stages    cumulative / own cpu per request')
+        for stage in result['stages']:
+            print(f"    {stage['cumulative']:8.4f}s {stage['own']:8.4f}s  {stage['name']}")
+
+async def Main(args: argparse.Namespace) -> list[dict[str, Any]]:
+    stubs = StubServer(latency=args.latency, osrm_latency=args.osrm_latency)
+    url = stubs.start()
+
+    # 설정은 module을 import할 때 읽으므로 app보다 먼저 지정
+    os.environ['VROOUTY_URL'] = url + '/'
+    os.environ['OSRM_JEJU_URL'] = url
+    os.environ['ATLAN_WRAPPER_URL'] = url
+    os.environ['OSRM_LEG_CACHE_PATH'] = ''
+    os.environ.setdefault('VERSION', 'benchmark')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import main
+
+    results = []
+
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            for name in args.endpoints:
+                result = await Benchmark(main.app, stubs, name, args)
+                Report(result)
+                results.append(result)
+    finally:
+        stubs.stop()
+
+    return results
+
+def Arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='jeju_onul API benchmark')
+
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--works', type=int, default=100)
+    parser.add_argument('--vehicles', type=int, default=4, help='auto_pilot은 4대로 고정')
+    parser.add_argument('--assemblies', type=int, default=2, help='auto_pilot은 3개로 고정')
+    parser.add_argument('--boundaries', type=int, default=4, help='v1에서는 group 수, auto_pilot은 4개로 고정')
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--profile', type=int, default=3, help='함수별 CPU 시간을 측정할 request 수 (0이면 생략)')
+    parser.add_argument('--top', type=int, default=15, help='출력할 함수 수')
+    parser.add_argument('--warm', action='store_true', help='cache를 유지하고 같은 request를 반복')
+
+    parser.add_argument('--latency', type=float, default=0.0, help='vroouty 응답 지연 (초)')
+    parser.add_argument('--osrm-latency', type=float, default=0.0, help='OSRM 응답 지연 (초)')
+
+    parser.add_argument('--output', help='결과를 저장할 json 파일')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = Arguments()
+
+    results = asyncio.run(Main(args))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,241 @@
+import asyncio
+import math
+import threading
+
+from aiohttp import web
+
+# 직선 거리를 이 속도(m/s)로 이동한다고 가정
+SPEED = 14.0
+
+def Distance(a, b) -> int:
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return int(2 * 6371000 * math.asin(math.sqrt(h)))
+
+def Duration(a, b) -> int:
+    return int(Distance(a, b) / SPEED)
+
+def Solve(request: dict) -> dict:
+    """
+    vroouty 응답 형식의 결정적인 greedy 배차
+
+    우선순위가 높고 가능한 차량이 적은 job(shipment)부터, 끝나는 시각이 가장 이른 차량의 경로 끝에 추가한다.
+    `skills`, 차량 `time_window`, `max_vehicle_work_time`을 지키지 못하면 unassigned로 남긴다.
+    request에 `matrices`가 있으면 `location_index`(`start_index`, `end_index`)로 차량 profile의 matrix를 사용하고,
+    없으면 engine이 stub OSRM으로 계산한 것과 같은 직선 거리를 사용한다.
+    """
+    max_work_time = request.get('distribute_options', {}).get('max_vehicle_work_time')
+    matrices = request.get('matrices')
+
+    # 위치: (좌표, matrix index)
+    def travel(profile: str, a: tuple, b: tuple) -> tuple[int, int]:
+        if matrices is not None and a[1] is not None and b[1] is not None:
+            matrix = matrices[profile]
+            return matrix['durations'][a[1]][b[1]], matrix['distances'][a[1]][b[1]]
+        return Duration(a[0], b[0]), Distance(a[0], b[0])
+
+    states = []
+    for v in request['vehicles']:
+        time_window = v.get('time_window', (0, 10 ** 10))
+        states.append({
+            'vehicle': v,
+            'profile': v.get('profile', 'car'),
+            'skills': set(v.get('skills', [])),
+            'time_window': time_window,
+            'end': (v['end'], v.get('end_index')) if 'end' in v else None,
+            'location': (v['start'], v.get('start_index')),
+            'time': time_window[0],
+            'duration': 0,
+            'distance': 0,
+            'steps': [ { 'type': 'start', 'location': v['start'], 'arrival': time_window[0], 'duration': 0, 'distance': 0, 'setup': 0, 'service': 0 } ],
+        })
+
+    orders = []
+    for j in request.get('jobs', []):
+        orders.append((j.get('priority', 0), set(j.get('skills', [])), [ ('job', j) ]))
+    for s in request.get('shipments', []):
+        orders.append((s.get('priority', 0), set(s.get('skills', [])), [ ('pickup', s['pickup']), ('delivery', s['delivery']) ]))
+
+    def candidates(skills: set) -> int:
+        return sum(1 for s in states if skills <= s['skills'])
+
+    orders.sort(key=lambda o: (-o[0], candidates(o[1])))
+
+    def insert(state: dict, points: list) -> tuple | None:
+        time, location, duration, distance = state['time'], state['location'], state['duration'], state['distance']
+        steps = []
+
+        for step_type, point in points:
+            target = (point['location'], point.get('location_index'))
+            travel_duration, travel_distance = travel(state['profile'], location, target)
+            time += travel_duration
+            duration += travel_duration
+            distance += travel_distance
+
+            steps.append({
+                'type': step_type,
+                'id': point['id'],
+                'location': point['location'],
+                'arrival': time,
+                'duration': duration,
+                'distance': distance,
+                'setup': point.get('setup', 0),
+                'service': point.get('service', 0),
+                'description': point.get('description', ''),
+            })
+
+            time += point.get('setup', 0) + point.get('service', 0)
+            location = target
+
+        end_time = time + (travel(state['profile'], location, state['end'])[0] if state['end'] is not None else 0)
+
+        if end_time > state['time_window'][1]:
+            return None
+        if max_work_time is not None and end_time - state['time_window'][0] > max_work_time:
+            return None
+
+        return steps, time, location, duration, distance
+
+    unassigned = []
+
+    for _, skills, points in orders:
+        best = None
+
+        for state in states:
+            if not skills <= state['skills']:
+                continue
+
+            inserted = insert(state, points)
+            if inserted is not None and (best is None or inserted[1] < best[1][1]):
+                best = (state, inserted)
+
+        if best is None:
+            unassigned += [ { 'id': point['id'], 'type': step_type, 'location': point['location'] } for step_type, point in points ]
+            continue
+
+        state, (steps, time, location, duration, distance) = best
+        state.update({ 'time': time, 'location': location, 'duration': duration, 'distance': distance })
+        state['steps'] += steps
+
+    routes = []
+    for state in states:
+        if len(state['steps']) == 1:
+            continue
+
+        time, location, duration, distance = state['time'], state['location'], state['duration'], state['distance']
+
+        if state['end'] is not None:
+            travel_duration, travel_distance = travel(state['profile'], location, state['end'])
+            time += travel_duration
+            duration += travel_duration
+            distance += travel_distance
+            location = state['end']
+
+        state['steps'].append({ 'type': 'end', 'location': location[0], 'arrival': time, 'duration': duration, 'distance': distance, 'setup': 0, 'service': 0 })
+
+        routes.append({
+            'vehicle': state['vehicle']['id'],
+            'steps': state['steps'],
+            'cost': duration,
+            'duration': duration,
+            'distance': distance,
+        })
+
+    return {
+        'code': 0,
+        'routes': routes,
+        'unassigned': unassigned,
+        'summary': {
+            'cost': sum(r['cost'] for r in routes),
+            'routes': len(routes),
+            'unassigned': len(unassigned),
+        },
+    }
+
+def Coordinates(text: str) -> list[tuple[float, float]]:
+    return [ tuple(map(float, c.split(','))) for c in text.split(';') ]
+
+class StubServer:
+    """
+    `VROOUTY_URL`, `OSRM_JEJU_URL`, `ATLAN_WRAPPER_URL`을 대신하는 local server
+
+    별도 thread의 event loop에서 실행되므로 benchmark 대상의 CPU 시간에 포함되지 않는다.
+    같은 request에는 항상 같은 응답을 주고, 응답마다 `latency`초(OSRM은 `osrm_latency`초)를 기다린다.
+    """
+
+    latency: float
+    osrm_latency: float
+    counts: dict[str, int]
+    url: str | None
+
+    def __init__(self, latency: float = 0.0, osrm_latency: float = 0.0) -> None:
+        self.latency = latency
+        self.osrm_latency = osrm_latency
+        self.counts = { 'vroouty': 0, 'osrm_route': 0, 'osrm_table': 0 }
+        self.url = None
+
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.__runner = None
+
+    def __app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 ** 2)
+        app.router.add_post('/', self.__vroouty)
+        app.router.add_get('/route/v1/{profile}/{coordinates}', self.__route)
+        app.router.add_get('/table/v1/{profile}/{coordinates}', self.__table)
+        return app
+
+    async def __vroouty(self, request: web.Request) -> web.Response:
+        self.counts['vroouty'] += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response(Solve(await request.json()))
+
+    async def __route(self, request: web.Request) -> web.Response:
+        self.counts['osrm_route'] += 1
+        await asyncio.sleep(self.osrm_latency)
+
+        locations = Coordinates(request.match_info['coordinates'])
+        legs = [ { 'duration': Duration(a, b), 'distance': Distance(a, b) } for a, b in zip(locations, locations[1:]) ]
+
+        return web.json_response({ 'code': 'Ok', 'routes': [ { 'legs': legs } ] })
+
+    async def __table(self, request: web.Request) -> web.Response:
+        self.counts['osrm_table'] += 1
+        await asyncio.sleep(self.osrm_latency)
+
+        locations = Coordinates(request.match_info['coordinates'])
+        sources = [ locations[int(i)] for i in request.query['sources'].split(';') ] if 'sources' in request.query else locations
+        destinations = [ locations[int(i)] for i in request.query['destinations'].split(';') ] if 'destinations' in request.query else locations
+
+        return web.json_response({
+            'code': 'Ok',
+            'durations': [ [ Duration(a, b) for b in destinations ] for a in sources ],
+            'distances': [ [ Distance(a, b) for b in destinations ] for a in sources ],
+        })
+
+    async def __start(self) -> str:
+        self.__runner = web.AppRunner(self.__app())
+        await self.__runner.setup()
+
+        site = web.TCPSite(self.__runner, '127.0.0.1', 0)
+        await site.start()
+
+        host, port = self.__runner.addresses[0][:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        self.__thread.start()
+        self.url = asyncio.run_coroutine_threadsafe(self.__start(), self.__loop).result()
+        return self.url
+
+    def stop(self) -> None:
+        if self.__runner is not None:
+            asyncio.run_coroutine_threadsafe(self.__runner.cleanup(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+    def reset(self) -> dict[str, int]:
+        counts = dict(self.counts)
+        for k in self.counts:
+            self.counts[k] = 0
+        return counts
@@ -0,0 +1,254 @@
+import asyncio
+import atexit
+from collections import OrderedDict
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Hashable
+
+# name: cache, `/cache`에서 hit/miss 조회
+caches: dict[str, 'LRUCache'] = {}
+
+def Canonical(data: Any) -> bytes:
+    """
+    key 순서, 공백과 무관한 json 표현
+    """
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+def Fingerprint(data: Any) -> str:
+    return hashlib.sha256(Canonical(data)).hexdigest()
+
+class SqliteStore:
+    """
+    `LRUCache` 뒤에 두는 on-disk key-value 저장소
+
+    key, value는 json으로 직렬화하여 저장하므로 value의 tuple은 list로 복원된다.
+    event loop를 막지 않도록 조회(`get_many`)는 `LRUCache.fetch`가 thread에서 실행하고,
+    기록(`update`)은 queue에 넣기만 하면 writer thread가 `interval`초 동안 모아서 한 번에 commit한다.
+    만료된 row는 열 때와 commit할 때 삭제한다.
+    """
+
+    path: str
+    ttl: float | None
+    interval: float
+
+    def __init__(self, path: str, ttl: float | None = None, interval: float = 1.0) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.interval = interval
+
+        # connection은 조회 thread와 writer thread가 공유
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.__lock:
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)'
+            )
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self.__prune()
+            self.__connection.commit()
+
+        self.__pending = queue.SimpleQueue()
+        self.__closed = threading.Event()
+
+        self.__writer = threading.Thread(target=self.__write, name=f'SqliteStore({path})', daemon=True)
+        self.__writer.start()
+
+        # 종료할 때 queue에 남은 기록을 commit
+        atexit.register(self.close)
+
+    def get_many(self, keys: list[Hashable]) -> dict[Hashable, Any]:
+        """
+        `keys` 중 만료되지 않은 값이 있는 key: value (blocking, event loop 밖에서 호출)
+        """
+        encoded = { json.dumps(k): k for k in keys }
+        encoded_keys = list(encoded)
+        now = time.time()
+
+        found = {}
+
+        with self.__lock:
+            # sqlite의 parameter 수 제한
+            for i in range(0, len(encoded_keys), 500):
+                chunk = encoded_keys[i:i+500]
+                rows = self.__connection.execute(
+                    f'SELECT key, value, expires FROM cache WHERE key IN ({",".join("?" * len(chunk))})', chunk
+                ).fetchall()
+
+                for key, value, expires in rows:
+                    if expires is None or now <= expires:
+                        found[encoded[key]] = json.loads(value)
+
+        return found
+
+    def update(self, items: dict[Hashable, Any]) -> None:
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self.__pending.put((list(items.items()), expires))
+
+    def close(self) -> None:
+        if self.__closed.is_set():
+            return
+
+        self.__closed.set()
+        self.__pending.put(None)
+        self.__writer.join()
+
+        with self.__lock:
+            self.__connection.close()
+
+    def __prune(self) -> None:
+        self.__connection.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    def __write(self) -> None:
+        while True:
+            batch = self.__pending.get()
+            if batch is None:
+                return
+
+            # 짧은 시간 동안 들어온 기록을 모아서 commit 횟수를 줄인다
+            self.__closed.wait(self.interval)
+
+            batches = [ batch ]
+            closed = False
+
+            while True:
+                try:
+                    batch = self.__pending.get_nowait()
+                except queue.Empty:
+                    break
+
+                if batch is None:
+                    closed = True
+                    break
+
+                batches.append(batch)
+
+            with self.__lock:
+                self.__connection.executemany(
+                    'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                    [ (json.dumps(k), json.dumps(v), expires) for items, expires in batches for k, v in items ],
+                )
+                self.__prune()
+                self.__connection.commit()
+
+            if closed:
+                return
+
+class LRUCache:
+    """
+    크기와 TTL이 제한된 in-process LRU cache
+
+    `store`가 주어지면 저장할 때 함께 기록하고, `fetch`에서 memory에 없는 key를 `store`에서 찾는다.
+    (`get`은 event loop를 막지 않도록 memory만 찾는다)
+    """
+
+    name: str
+    maxsize: int
+    ttl: float | None
+    store: SqliteStore | None
+
+    hits: int
+    store_hits: int
+    misses: int
+
+    __items: OrderedDict
+
+    def __init__(self, name: str, maxsize: int, ttl: float | None = None, store: SqliteStore | None = None) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+        self.__items = OrderedDict()
+
+        caches[name] = self
+
+    def get(self, key: Hashable) -> Any | None:
+        value = self.__get(key)
+
+        if value is None:
+            self.misses += 1
+
+        return value
+
+    async def fetch(self, keys: list[Hashable]) -> list[Any | None]:
+        """
+        `keys` 순서대로 값(없으면 None), memory에 없는 key들은 `store`에서 thread로 한 번에 찾는다.
+        """
+        values = [ self.__get(k) for k in keys ]
+
+        missing = [ k for k, v in zip(keys, values) if v is None ]
+
+        if self.store is not None and len(missing) > 0:
+            found = await asyncio.to_thread(self.store.get_many, list(dict.fromkeys(missing)))
+
+            for k, v in found.items():
+                self.__set(k, v)
+
+            values = [ found.get(k) if v is None else v for k, v in zip(keys, values) ]
+            self.store_hits += sum(1 for k in missing if k in found)
+
+        self.misses += sum(1 for v in values if v is None)
+
+        return values
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.update({ key: value })
+
+    def update(self, items: dict[Hashable, Any]) -> None:
+        for k, v in items.items():
+            self.__set(k, v)
+
+        if self.store is not None and len(items) > 0:
+            self.store.update(items)
+
+    def __get(self, key: Hashable) -> Any | None:
+        if key not in self.__items:
+            return None
+
+        value, expires = self.__items[key]
+
+        if expires is not None and time.monotonic() >= expires:
+            del self.__items[key]
+            return None
+
+        self.__items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __set(self, key: Hashable, value: Any) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        self.__items[key] = (value, expires)
+        self.__items.move_to_end(key)
+
+        while len(self.__items) > self.maxsize:
+            self.__items.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self.__items.pop(key, None)
+
+    def clear(self) -> None:
+        self.__items.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.store_hits + self.misses
+
+        return {
+            'size': len(self.__items),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'store': self.store.path if self.store is not None else None,
+            'hits': self.hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.store_hits) / requests if requests > 0 else None,
+        }
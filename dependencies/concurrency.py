@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable, Sequence
+
+from dependencies.log import GetLogger
+
+logger = GetLogger('concurrency')
+
+async def gather(aws: Iterable[Awaitable], limit: int | None = None, return_exceptions: bool = False) -> list:
+    """
+    `aws`를 동시에 실행하고 입력 순서대로 결과를 반환한다.
+
+    `limit`이 주어지면 동시에 실행되는 개수를 제한하고,
+    `return_exceptions=False`인 경우 하나라도 실패하면 나머지를 취소한다.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit is not None else None
+
+    async def run(aw: Awaitable):
+        try:
+            if semaphore is None:
+                return await aw
+            async with semaphore:
+                return await aw
+        finally:
+            # 시작하기 전에 취소된 coroutine 정리
+            if asyncio.iscoroutine(aw):
+                aw.close()
+
+    tasks = [ asyncio.ensure_future(run(aw)) for aw in aws ]
+
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+    finally:
+        for t in tasks:
+            t.cancel()
+
+class StageGraph:
+    """
+    의존 관계가 있는 stage들을 실행한다.
+
+    선행 stage가 모두 끝난 stage는 바로 시작하므로 서로 독립인 stage는 동시에 실행되고,
+    각 stage는 선행 stage들의 결과를 이름으로 받는다. (`func(**{name: result})`)
+    """
+
+    name: str
+    stages: dict[str, tuple[Callable[..., Awaitable], list[str]]]
+    timings: dict[str, tuple[float, float]]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable], after: Sequence[str] = ()) -> None:
+        if name in self.stages:
+            raise ValueError(f'duplicated stage: {name}')
+
+        # 이미 추가된 stage에만 의존할 수 있으므로 순환이 생기지 않는다
+        for dependency in after:
+            if dependency not in self.stages:
+                raise ValueError(f'unknown stage: {dependency}')
+
+        self.stages[name] = (func, list(after))
+
+    async def run(self) -> dict[str, Any]:
+        """
+        모든 stage를 실행하고 stage별 결과를 반환한다. 하나라도 실패하면 나머지를 취소한다.
+        """
+        start = time.perf_counter()
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_stage(name: str, func: Callable[..., Awaitable], after: list[str]):
+            inputs = { dependency: await tasks[dependency] for dependency in after }
+
+            stage_start = time.perf_counter()
+            result = await func(**inputs)
+            self.timings[name] = (stage_start - start, time.perf_counter() - start)
+
+            return result
+
+        for name, (func, after) in self.stages.items():
+            tasks[name] = asyncio.ensure_future(run_stage(name, func, after))
+
+        try:
+            results = await asyncio.gather(*tasks.values())
+        finally:
+            for t in tasks.values():
+                t.cancel()
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('%s stages: %s', self.name, ', '.join([
+                f'{name} {begin:.3f}~{end:.3f}s' for name, (begin, end) in self.timings.items()
+            ]))
+
+        return dict(zip(tasks.keys(), results))
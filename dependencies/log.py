@@ -0,0 +1,29 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# DEBUG: 최적화 과정의 중간 결과까지 출력, INFO: 요약과 stage 시간, WARNING: 외부 API 오류
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# handler에서는 queue에 넣기만 하고 출력(I/O)은 `listener`의 thread에서 처리한다
+_records = queue.SimpleQueue()
+
+_stream = logging.StreamHandler(sys.stdout)
+_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+# QueueHandler를 붙이는 즉시 record를 소비해야 하므로 import 시점에 시작하고,
+# lifespan 밖(스크립트, worker, 테스트)에서도 종료 시 queue에 남은 log를 모두 출력한다
+listener = logging.handlers.QueueListener(_records, _stream, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+logger = logging.getLogger('jeju_onul')
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(logging.handlers.QueueHandler(_records))
+logger.propagate = False
+
+def GetLogger(name: str) -> logging.Logger:
+    return logger.getChild(name)
@@ -1,6 +1,12 @@
-import aiohttp
 import os
 
+import dependencies.concurrency as concurrency
+from dependencies.cache import LRUCache, SqliteStore
+from dependencies.log import GetLogger
+from dependencies.pool import Client
+
+logger = GetLogger('osrm')
+
 urls = {
     'car': os.environ['OSRM_JEJU_URL'],
     'atlan': os.environ['ATLAN_WRAPPER_URL'],
@@ -14,6 +20,25 @@ PARAMS = {
     'continue_straight': 'false'
 }
 
+client = Client(limit_per_host=int(os.getenv('OSRM_CONNECTION_LIMIT', '32')))
+
+# 한 번에 동시에 보내는 최대 요청 수
+MAX_CONCURRENCY = int(os.getenv('OSRM_MAX_CONCURRENCY', '16'))
+
+# table 한 번에 보낼 수 있는 최대 좌표 수 (osrm-routed `--max-table-size`, 기본 100)
+TABLE_MAX_SIZE = int(os.getenv('OSRM_TABLE_MAX_SIZE', '100'))
+
+LEG_CACHE_TTL = float(os.getenv('OSRM_LEG_CACHE_TTL', '86400'))
+LEG_CACHE_PATH = os.getenv('OSRM_LEG_CACHE_PATH')
+
+# (profile, from, to): (duration, distance)
+legs = LRUCache(
+    'osrm_legs',
+    maxsize=int(os.getenv('OSRM_LEG_CACHE_SIZE', '100000')),
+    ttl=LEG_CACHE_TTL,
+    store=SqliteStore(LEG_CACHE_PATH, ttl=LEG_CACHE_TTL) if LEG_CACHE_PATH else None,
+)
+
 async def GetRoutes(profile: str, locations) -> tuple[int, dict]:
     path = 'route/v1/car'
 
@@ -22,13 +47,137 @@ async def GetRoutes(profile: str, locations) -> tuple[int, dict]:
 
     url = f"{urls[profile]}/{path}/{encoded_locations}?{encoded_params}"
 
-    async with aiohttp.ClientSession() as session:
-        response = await session.get(url)
+    session = await client.session()
+
+    async with session.get(url) as response:
 
         json = await response.json()
         status = response.status
 
         if status != 200:
-            print(status, json)
+            logger.warning('%s %s', status, json)
 
         return status, json
+
+async def GetTable(
+        profile: str,
+        locations,
+        sources: list[int] | None = None,
+        destinations: list[int] | None = None,
+        ) -> tuple[int, dict]:
+    path = 'table/v1/car'
+
+    params = {
+        'annotations': 'duration,distance',
+        'generate_hints': 'false',
+    }
+    if sources is not None:
+        params['sources'] = ';'.join(str(i) for i in sources)
+    if destinations is not None:
+        params['destinations'] = ';'.join(str(i) for i in destinations)
+
+    encoded_locations = ";".join(f"{loc[0]},{loc[1]}" for loc in locations)
+    encoded_params = "&".join((f"{k}={v}") for k, v in params.items())
+
+    url = f"{urls[profile]}/{path}/{encoded_locations}?{encoded_params}"
+
+    session = await client.session()
+
+    async with session.get(url) as response:
+
+        json = await response.json()
+        status = response.status
+
+        if status != 200:
+            logger.warning('%s %s', status, json)
+
+        return status, json
+
+async def GetMatrix(profile: str, locations) -> tuple[list[list[float]], list[list[float]]] | None:
+    """
+    `locations` 간 (durations, distances) matrix
+
+    좌표 수가 `TABLE_MAX_SIZE`를 넘으면 출발, 도착 위치를 나눈 block별로 table을 요청하고,
+    하나라도 실패하거나 연결되지 않은 구간이 있으면 None
+    """
+    n = len(locations)
+
+    # block 하나에 출발, 도착 위치가 모두 포함되므로 한 쪽은 절반까지
+    size = n if n <= TABLE_MAX_SIZE else max(1, TABLE_MAX_SIZE // 2)
+    chunks = [ range(i, min(i + size, n)) for i in range(0, n, size) ]
+
+    durations = [ [ 0.0 ] * n for _ in range(n) ]
+    distances = [ [ 0.0 ] * n for _ in range(n) ]
+
+    async def fetch(sources: range, destinations: range) -> bool:
+        if sources == destinations:
+            status, json = await GetTable(profile, [ locations[i] for i in sources ])
+        else:
+            status, json = await GetTable(
+                profile,
+                [ locations[i] for i in sources ] + [ locations[j] for j in destinations ],
+                sources=list(range(len(sources))),
+                destinations=list(range(len(sources), len(sources) + len(destinations))),
+            )
+
+        if status != 200:
+            return False
+
+        for si, i in enumerate(sources):
+            for dj, j in enumerate(destinations):
+                duration, distance = json['durations'][si][dj], json['distances'][si][dj]
+
+                # 연결되지 않은 구간
+                if duration is None or distance is None:
+                    return False
+
+                durations[i][j], distances[i][j] = duration, distance
+
+        return True
+
+    fetched = await concurrency.gather(
+        [ fetch(sources, destinations) for sources in chunks for destinations in chunks ],
+        limit=MAX_CONCURRENCY,
+    )
+
+    if not all(fetched):
+        return None
+
+    return durations, distances
+
+async def GetLegs(profile: str, locations) -> list[tuple[float, float] | None]:
+    """
+    연속된 `locations` 사이 구간별 (duration, distance)
+
+    cache에 없는 구간만 연속된 구간끼리 묶어서 요청하고, 요청에 실패한 구간은 None
+    """
+    keys = [ (profile, tuple(a), tuple(b)) for a, b in zip(locations, locations[1:]) ]
+    result = await legs.fetch(keys)
+
+    runs: list[tuple[int, int]] = []
+
+    for i, leg in enumerate(result):
+        if leg is not None:
+            continue
+        if len(runs) > 0 and runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], i + 1)
+        else:
+            runs.append((i, i + 1))
+
+    async def fetch(start: int, end: int):
+        status, json = await GetRoutes(profile, locations[start:end+1])
+
+        if status != 200:
+            return
+
+        fetched = {}
+
+        for i, leg in enumerate(json['routes'][0]['legs']):
+            result[start+i] = (leg['duration'], leg['distance'])
+            fetched[keys[start+i]] = result[start+i]
+
+        legs.update(fetched)
+
+    await concurrency.gather([ fetch(start, end) for start, end in runs ], limit=MAX_CONCURRENCY)
+
+    return result
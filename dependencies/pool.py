@@ -0,0 +1,44 @@
+import aiohttp
+import os
+
+DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+
+class Client:
+    """
+    upstream 하나에 대해 application 수명 동안 재사용하는 `aiohttp.ClientSession`
+
+    keep-alive connection pool과 DNS cache를 공유하므로
+    호출마다 TCP 연결을 새로 맺지 않는다.
+    """
+
+    limit_per_host: int
+
+    __session: aiohttp.ClientSession | None
+
+    def __init__(self, limit_per_host: int) -> None:
+        self.limit_per_host = limit_per_host
+        self.__session = None
+
+    async def open(self) -> None:
+        if self.__session is not None and not self.__session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        self.__session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self) -> None:
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        # lifespan 밖(스크립트, 테스트 등)에서 호출된 경우 lazy하게 생성
+        await self.open()
+        return self.__session
@@ -0,0 +1,13 @@
+from fastapi import Response
+from pydantic import BaseModel
+
+def ModelResponse(model: BaseModel, exclude_none: bool = True) -> Response:
+    """
+    `response_model`로 다시 검증하지 않고 model을 바로 json으로 직렬화한 response
+
+    endpoint의 `response_model`은 문서(OpenAPI)에만 사용된다.
+    """
+    return Response(
+        content=model.model_dump_json(exclude_none=exclude_none),
+        media_type='application/json',
+    )
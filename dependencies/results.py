@@ -0,0 +1,93 @@
+import os
+from typing import Any
+
+from dependencies.cache import Fingerprint, LRUCache
+from dependencies.log import GetLogger
+
+logger = GetLogger('results')
+
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '128'))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '600'))
+
+# 다음 request로 넘겨주는 vroouty 응답의 최대 개수
+RESULT_CACHE_MEMO_SIZE = int(os.getenv('RESULT_CACHE_MEMO_SIZE', '64'))
+
+def TrimMemo(memo: dict[str, bytes]) -> dict[str, bytes]:
+    """
+    다음 request로 넘겨줄 memo, 최근에 사용한 `RESULT_CACHE_MEMO_SIZE`개의 응답만 남긴다.
+    """
+    return dict(list(memo.items())[-RESULT_CACHE_MEMO_SIZE:])
+
+class Entry:
+    key: str
+    base: str
+    works: dict[str, str]
+
+    result: Any | None
+
+    # `works`, `current_time` 외의 정보가 같은 이전 request의 결과와 그 사이에 바뀐(추가, 삭제 포함) work id
+    previous: Any | None
+    changed: set[str]
+
+    def __init__(self, key: str, base: str, works: dict[str, str]) -> None:
+        self.key = key
+        self.base = base
+        self.works = works
+
+        self.result = None
+        self.previous = None
+        self.changed = set()
+
+class ResultCache:
+    """
+    request 단위 최적화 결과 cache
+
+    같은 request는 이전 결과를 그대로 반환한다.
+    `previous=True`이면 `works`, `current_time` 외의 정보가 같은 마지막 결과를 함께 보관하여,
+    일부 work만 바뀐 request에서 바뀐 work와 무관한 차량의 초기 경로(warm start)로 사용할 수 있도록 한다.
+
+    hit rate는 `/cache`의 `{name}`(결과), `{name}_previous`(delta) 항목으로 조회한다.
+    """
+
+    results: LRUCache
+    previous: LRUCache | None
+
+    def __init__(self, name: str, previous: bool = False) -> None:
+        self.results = LRUCache(name, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+        # base: (works, result)
+        self.previous = LRUCache(f'{name}_previous', maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL) if previous else None
+
+    def get(self, data: dict) -> Entry:
+        """
+        `data`: `works`를 포함하여 결과에 영향을 주는 request의 모든 정보 (json 직렬화 가능)
+        """
+        works = { str(w['id']): Fingerprint(w) for w in data['works'] }
+        entry = Entry(
+            key=Fingerprint(data),
+            # current_time만 바뀐 request도 이전 결과를 이어받는다
+            base=Fingerprint({ k: v for k, v in data.items() if k not in ('works', 'current_time') }),
+            works=works,
+        )
+
+        entry.result = self.results.get(entry.key)
+        if entry.result is not None or self.previous is None:
+            return entry
+
+        previous = self.previous.get(entry.base)
+        if previous is not None:
+            previous_works, entry.previous = previous
+
+            entry.changed = {
+                work_id for work_id in previous_works.keys() | works.keys()
+                if previous_works.get(work_id) != works.get(work_id)
+            }
+            logger.info('delta: %d works changed', len(entry.changed))
+
+        return entry
+
+    def set(self, entry: Entry, result: Any) -> None:
+        self.results.set(entry.key, result)
+
+        if self.previous is not None:
+            self.previous.set(entry.base, (entry.works, result))
@@ -1,16 +1,189 @@
-import aiohttp
+import asyncio
+import json
 import os
 
+import aiohttp
+
+from dependencies.cache import Fingerprint, LRUCache
+from dependencies.log import GetLogger
+from dependencies.pool import Client
+import dependencies.osrm as osrm
+
 BASE_URL = os.environ['VROOUTY_URL']
 
-async def Post(request: dict) -> tuple[int, dict]:
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(BASE_URL, json=request, headers={'Content-Type':'application/json'})
+logger = GetLogger('vroouty')
+
+client = Client(limit_per_host=int(os.getenv('VROOUTY_CONNECTION_LIMIT', '16')))
+
+# 차량별 request 등 서로 독립인 request를 동시에 보낼 때의 최대 개수
+MAX_CONCURRENCY = int(os.getenv('VROOUTY_MAX_CONCURRENCY', '8'))
+
+# 동일한 request의 200 응답을 짧은 시간 동안 재사용 (key: `Key(request)`, value: response body)
+responses = LRUCache(
+    'vroouty_responses',
+    maxsize=int(os.getenv('VROOUTY_RESPONSE_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('VROOUTY_RESPONSE_CACHE_TTL', '300')),
+)
+
+# request에 포함된 위치들의 matrix를 직접 계산하여 전달 (engine의 matrix 계산 생략)
+LOCAL_MATRIX = os.getenv('VROOUTY_LOCAL_MATRIX', '0') == '1'
+
+# 위치가 이보다 많으면 matrix를 전달하지 않고 engine에서 계산 (table 요청 수와 request 크기가 위치 수의 제곱에 비례)
+LOCAL_MATRIX_MAX_SIZE = int(os.getenv('VROOUTY_LOCAL_MATRIX_MAX_SIZE', '400'))
+
+# (profile, locations): (durations, distances)
+matrices = LRUCache(
+    'vroouty_matrices',
+    maxsize=int(os.getenv('VROOUTY_MATRIX_CACHE_SIZE', '64')),
+    ttl=osrm.LEG_CACHE_TTL,
+)
+
+# matrix를 계산하지 못한 (profile, locations), 같은 탐색의 다음 request에서 table을 다시 요청하지 않는다
+matrix_failures = LRUCache(
+    'vroouty_matrix_failures',
+    maxsize=int(os.getenv('VROOUTY_MATRIX_CACHE_SIZE', '64')),
+    ttl=float(os.getenv('VROOUTY_MATRIX_FAILURE_TTL', '60')),
+)
+
+# 계산 중인 matrix, 동시에 보내는 request들이 같은 matrix를 기다린다
+_computing: dict[tuple, asyncio.Task] = {}
+
+async def ComputeMatrix(profile: str, locations: tuple) -> tuple[list[list[int]], list[list[int]]] | None:
+    key = (profile, locations)
+
+    try:
+        matrix = await osrm.GetMatrix(profile, locations)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning('matrix %s (%d locations): %s', profile, len(locations), e)
+        matrix = None
+
+    if matrix is None:
+        matrix_failures.set(key, True)
+        return None
+
+    durations, distances = matrix
+    matrix = (
+        [ [ round(v) for v in row ] for row in durations ],
+        [ [ round(v) for v in row ] for row in distances ],
+    )
+    matrices.set(key, matrix)
+
+    return matrix
+
+async def GetMatrix(profile: str, locations: tuple) -> tuple[list[list[int]], list[list[int]]] | None:
+    key = (profile, locations)
+
+    matrix = matrices.get(key)
+    if matrix is not None:
+        return matrix
+
+    if matrix_failures.get(key) is not None:
+        return None
+
+    task = _computing.get(key)
+    if task is None:
+        task = asyncio.ensure_future(ComputeMatrix(profile, locations))
+        _computing[key] = task
+        task.add_done_callback(lambda _: _computing.pop(key, None))
+
+    # 기다리던 request가 취소되어도 다른 request를 위해 계산은 계속한다
+    return await asyncio.shield(task)
 
-        json = await response.json()
+async def AttachMatrices(request: dict) -> dict:
+    """
+    request의 모든 위치에 `location_index`를 지정하고 profile별 `matrices`를 추가한 request
+
+    `distribute_options`는 그대로 전달하고, `custom_matrix`에 `enabled` 외의 설정이 있거나 `matrices`가 이미 있는 경우,
+    위치가 `LOCAL_MATRIX_MAX_SIZE`보다 많은 경우, matrix를 계산하지 못한 경우에는 기존 request를 그대로 반환한다.
+    """
+    options = request.get('distribute_options', {})
+    if 'matrices' in request or len(set(options.get('custom_matrix', {})) - { 'enabled' }) > 0:
+        return request
+
+    indexes: dict[tuple, int] = {}
+
+    def index(location) -> int:
+        return indexes.setdefault(tuple(location), len(indexes))
+
+    vehicles = []
+    for v in request['vehicles']:
+        v = { **v, 'start_index': index(v['start']) }
+        if 'end' in v:
+            v['end_index'] = index(v['end'])
+        vehicles.append(v)
+
+    jobs = [ { **j, 'location_index': index(j['location']) } for j in request['jobs'] ]
+
+    shipments = [
+        {
+            **s,
+            'pickup': { **s['pickup'], 'location_index': index(s['pickup']['location']) },
+            'delivery': { **s['delivery'], 'location_index': index(s['delivery']['location']) },
+        }
+        for s in request['shipments']
+    ]
+
+    locations = tuple(indexes.keys())
+    if len(locations) > LOCAL_MATRIX_MAX_SIZE:
+        return request
+
+    profiles = sorted({ v.get('profile', 'car') for v in vehicles })
+
+    results = await asyncio.gather(*[ GetMatrix(p, locations) for p in profiles ])
+
+    if any(r is None for r in results):
+        return request
+
+    return {
+        **request,
+        'jobs': jobs,
+        'shipments': shipments,
+        'vehicles': vehicles,
+        'matrices': {
+            p: { 'durations': durations, 'distances': distances }
+            for p, (durations, distances) in zip(profiles, results)
+        },
+    }
+
+def Key(request: dict) -> str:
+    return Fingerprint(request)
+
+async def Post(request: dict, memo: dict[str, bytes] | None = None) -> tuple[int, dict]:
+    """
+    `memo`는 요청(API 호출) 단위 cache로, 같은 최적화 과정에서 반복되는 request를 다시 계산하지 않는다.
+
+    응답은 body로 저장해두고 반환할 때마다 새로 읽으므로 호출한 쪽에서 수정해도 cache에 영향이 없다.
+    """
+    key = Key(request)
+
+    body = memo.pop(key, None) if memo is not None else None
+    if body is None:
+        body = responses.get(key)
+
+    if body is not None:
+        if memo is not None:
+            # 최근에 사용한 순서로 유지
+            memo[key] = body
+        return 200, json.loads(body)
+
+    if LOCAL_MATRIX:
+        request = await AttachMatrices(request)
+
+    session = await client.session()
+
+    async with session.post(BASE_URL, json=request, headers={'Content-Type':'application/json'}) as response:
+
+        body = await response.read()
         status = response.status
 
+        result = json.loads(body)
+
         if status != 200:
-            print(status, json)
+            logger.warning('%s %s', status, result)
+            return status, result
+
+        responses.set(key, body)
+        if memo is not None:
+            memo[key] = body
 
-        return status, json
+        return status, result
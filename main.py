@@ -1,14 +1,33 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from routers.maintain import router as maintain_router
 from routers.v1.jeju_onul import router as jeju_onul_v1_router
 from routers.v2.jeju_onul import router as jeju_onul_v2_router
 
+import dependencies.vroouty as vroouty
+import dependencies.osrm as osrm
+
 import env
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # upstream별 connection pool을 application 수명 동안 공유
+    try:
+        await vroouty.client.open()
+        await osrm.client.open()
+
+        yield
+    finally:
+        # 열지 않은 client의 close는 아무 것도 하지 않는다
+        await vroouty.client.close()
+        await osrm.client.close()
+
 app = FastAPI(
     title='Roouty Dynamic Engine',
-    version=env.VERSION
+    version=env.VERSION,
+    lifespan=lifespan,
 )
 
 app.include_router(maintain_router)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, NonNegativeInt, NonNegativeFloat
+from pydantic import BaseModel, Field, NonNegativeInt, NonNegativeFloat, PositiveInt
 
 from enum import Enum
 
@@ -13,8 +13,42 @@ class SecondAssemblyAlgorithm(BaseModel):
     assembly_time_candidates: list[int] = Field(
         default=[7200, 10800, 14400, 18000],
     )
+    max_concurrency: PositiveInt = Field(
+        default=4,
+        description='`select_best`에서 동시에 계산하는 `assembly_time_candidates`의 최대 개수',
+    )
+
+class EndTimeSearchType(Enum):
+    bisection = 'bisection'
+    bracketed = 'bracketed'
+    kary = 'kary'
+
+class EndTimeSearch(BaseModel):
+    type: EndTimeSearchType = Field(
+        default=EndTimeSearchType.bracketed,
+        description='''최소 종료 시간 탐색 방법\n
+`bisection`: `start` ~ `start + 24시간` 구간 이분탐색\n
+`bracketed`: 종료 시간 제한 없이 먼저 계산한 뒤, 실제 종료 시간과 이전 계획의 종료 시간으로 구간을 좁혀 탐색\n
+`kary`: `bracketed`와 같이 구간을 정한 뒤, 매 round마다 `parallelism`개의 종료 시간을 동시에 계산하여 구간을 좁혀 탐색
+''',
+    )
+    resolution: PositiveInt = Field(
+        default=1000,
+        description='탐색을 종료하는 구간의 크기 (in seconds)',
+    )
+    parallelism: PositiveInt = Field(
+        default=4,
+        description='`kary`에서 round마다 동시에 계산하는 종료 시간의 개수. routing engine의 `threads`에 맞춰 설정',
+    )
 
 class Algorithm(BaseModel):
     second_assembly: SecondAssemblyAlgorithm = Field(
         default=SecondAssemblyAlgorithm(),
     )
+    end_time_search: EndTimeSearch = Field(
+        default=EndTimeSearch(),
+    )
+    warm_start: bool = Field(
+        default=False,
+        description='이전 최적화 결과(`VehicleSchedule.tasks`)를 차량별 초기 경로(`steps`)로 전달하여 routing engine이 이전 계획에서 탐색을 시작하도록 한다. 초기 경로가 현재 조건에서 불가능하면 초기 경로 없이 다시 계산. `/jeju_onul`은 일부 work만 바뀐 이전 request의 결과가 있으면 그 결과를 초기 경로로 사용',
+    )
@@ -1,10 +1,18 @@
 from fastapi import HTTPException
 from http import HTTPStatus
+import logging
+from typing import Iterable
 
+from .algorithm import *
 from .transaction import *
 
 import dependencies.vroouty as vroouty
 import dependencies.osrm as osrm
+import dependencies.concurrency as concurrency
+from dependencies.cache import Fingerprint
+from dependencies.log import GetLogger
+
+logger = GetLogger('v1.internal')
 
 class Wave:
     vehicles: list[VehicleSchedule]
@@ -76,6 +84,15 @@ class Skills:
     __skills: dict[str, int]
     __waves: list[int]
     __vehicles: list[int]
+
+    # (wave, vehicle): 해당 차량이 처리할 수 없음을 나타내는 skill의 bit (`1 << skill`)
+    __wave_vehicle_bits: dict[tuple[int, int], int]
+    __all_bits: int
+
+    # 주문의 skill은 group, status 종류, 차량, wave와 schedule에만 의존하므로
+    # first_optimization, second_optimization (select_best의 모든 후보)에서 공유한다.
+    # 반환된 list는 수정하지 않는다.
+    __memo: dict[tuple, list[int]]
     __group_vehicles: dict[str, set[tuple[int, int]]]
     __assembly_visits: dict[int, dict[str, dict[int, set[int]]]]
 
@@ -89,6 +106,7 @@ class Skills:
 
         self.__unique_skill_id = 0
         self.__skills = {}
+        self.__memo = {}
 
         self.__waves = [ w for w in waves ]
         self.__vehicles = [ v.id for v in vehicles ]
@@ -119,10 +137,18 @@ class Skills:
 
         self.__skill_ids = {v: k for k, v in self.__skills.items()}
 
-        print('skills', self.__skills)
-        print('skill_ids', self.__skill_ids)
-        print('assembly_visits', self.__assembly_visits)
-        print('group_vehicles', self.__group_vehicles)
+        self.__wave_vehicle_bits = {
+            (w, v): 1 << self.__skills[self.__wave_vehicle_neg_key(w, v)]
+            for w in self.__waves for v in self.__vehicles
+        }
+        self.__all_bits = 0
+        for bit in self.__wave_vehicle_bits.values():
+            self.__all_bits |= bit
+
+        logger.debug('skills %s', self.__skills)
+        logger.debug('skill_ids %s', self.__skill_ids)
+        logger.debug('assembly_visits %s', self.__assembly_visits)
+        logger.debug('group_vehicles %s', self.__group_vehicles)
 
     def __wave_vehicle_neg_key(self, w: int, v: int) -> str:
         return f'!w{w}-v{v}'
@@ -132,35 +158,47 @@ class Skills:
             self.__skills[key] = self.__unique_skill_id
             self.__unique_skill_id += 1
 
-    def get_vehicle_skills(self, wave: int, vehicle: VehicleSchedule) -> list[int]:
-        skills = set()
+    def __skill_list(self, bits: int) -> list[int]:
+        # bitmask -> 오름차순 skill list
+        skills = []
 
-        for w in self.__waves:
-            for v in self.__vehicles:
-                if w == wave and v == vehicle.id:
-                    continue
-                skills.add(self.__skills[self.__wave_vehicle_neg_key(w, v)])
+        while bits:
+            lowest = bits & -bits
+            skills.append(lowest.bit_length() - 1)
+            bits ^= lowest
+
+        return skills
+
+    def __remember(self, key: tuple, skills: list[int]) -> list[int]:
+        self.__memo[key] = skills
+        return skills
 
-        return sorted(list(skills))
+    def get_vehicle_skills(self, wave: int, vehicle: VehicleSchedule) -> list[int]:
+        # 자신을 제외한 모든 (wave, vehicle)의 negative skill
+        return self.__skill_list(self.__all_bits & ~self.__wave_vehicle_bits.get((wave, vehicle.id), 0))
 
     def get_task_skills_wave_vehicles(self, wave_vehicles: list[tuple[int, int]]) -> list[int]:
-        skills = set()
+        key = ('wave_vehicles', frozenset(wave_vehicles))
+        if key in self.__memo:
+            return self.__memo[key]
 
-        for w in self.__waves:
-            for v in self.__vehicles:
-                if (w, v) in wave_vehicles:
-                    continue
-                skills.add(self.__skills[self.__wave_vehicle_neg_key(w, v)])
+        # wave_vehicles를 제외한 모든 (wave, vehicle)의 negative skill
+        bits = self.__all_bits
+
+        for wv in wave_vehicles:
+            bits &= ~self.__wave_vehicle_bits.get(wv, 0)
 
-        print('wave_vehicles', wave_vehicles)
-        return sorted(list(skills))
+        logger.debug('wave_vehicles %s', wave_vehicles)
+        return self.__remember(key, self.__skill_list(bits))
 
     def get_task_skills_assembly_visits(
             self,
             work: Work, assembly_visits: list[tuple[int, str, int]],
             pickup_group: bool, delivery_group: bool,
             ) -> list[int]:
-        skills = set()
+        key = ('assembly_visits', work.pickup.group if pickup_group else None, work.delivery.group if delivery_group else None, tuple(assembly_visits))
+        if key in self.__memo:
+            return self.__memo[key]
 
         accessable_wave_vehicles = set()
 
@@ -172,17 +210,17 @@ class Skills:
                     continue
                 accessable_wave_vehicles.add((w, v))
 
-        print('assembly_visits')
-        skills = skills.union(self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
-
-        return sorted(list(skills))
+        logger.debug('assembly_visits')
+        return self.__remember(key, self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
 
     def get_task_skills_meet_shipped_vehicle(
             self,
             work: Work, wave: int, vehicle: int,
             shipped_can_deliver: bool,
             ) -> list[int]:
-        skills = set()
+        key = ('meet_shipped_vehicle', work.delivery.group, wave, vehicle, shipped_can_deliver)
+        if key in self.__memo:
+            return self.__memo[key]
 
         accessable_wave_vehicles = set()
 
@@ -200,15 +238,15 @@ class Skills:
                     for ww in range(w, 4):
                         accessable_wave_vehicles.add((ww, v))
 
-        print(wave, vehicle, shipped_can_deliver, accessable_wave_vehicles)
-
-        print('meet_shipped_vehicle')
-        skills = skills.union(self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
+        logger.debug('%s %s %s %s', wave, vehicle, shipped_can_deliver, accessable_wave_vehicles)
 
-        return sorted(list(skills))
+        logger.debug('meet_shipped_vehicle')
+        return self.__remember(key, self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
 
     def get_task_skills_waiting_pickup(self, w: Work):
-        skills = set()
+        key = ('waiting_pickup', w.pickup.group, w.delivery.group)
+        if key in self.__memo:
+            return self.__memo[key]
 
         accessable_wave_vehicles = set()
 
@@ -232,13 +270,13 @@ class Skills:
                     # 해당 차량이 pickup 가능
                     accessable_wave_vehicles.add((pw, pv))
 
-        print('waiting_pickup')
-        skills = skills.union(self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
-
-        return sorted(list(skills))
+        logger.debug('waiting_pickup')
+        return self.__remember(key, self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
 
     def get_task_skills_waiting_shipment(self, w: Work):
-        skills = set()
+        key = ('waiting_shipment', w.pickup.group)
+        if key in self.__memo:
+            return self.__memo[key]
 
         accessable_wave_vehicles = set()
 
@@ -251,10 +289,8 @@ class Skills:
 
             accessable_wave_vehicles.add((w, v))
 
-        print('waiting_shipment')
-        skills = skills.union(self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
-
-        return sorted(list(skills))
+        logger.debug('waiting_shipment')
+        return self.__remember(key, self.get_task_skills_wave_vehicles(list(accessable_wave_vehicles)))
 
 class WorkHandler:
     __unique_index: int
@@ -298,10 +334,197 @@ class WorkHandler:
     def work_id(self, index: int) -> tuple[str, int]:
         return self.__index_to_id[index]
 
+    def index_of(self, key: tuple) -> int:
+        # `work_id`의 반대, 이미 사용된 key만 가능
+        return self.__id_to_index[key]
+
     def is_dummy(self, index: int) -> bool:
         return self.__index_to_id[index][0] in ['dummy', 'shipment_assembly']
 
+class SwapPlanner:
+    """
+    wave별 pickup, delivery 차량으로부터 집결지에서 교환할 주문(`swap_1_2`, `swap_2_3`)을 계산한다.
+
+    pickup 차량과 delivery 차량이 만나는 집결지가 없는 주문은 전체 결과를 실패시키지 않고 `unmatched`로 모은다.
+    """
+
+    # (wave, vehicle_id): 출발 / 도착 집결지
+    departures: dict[tuple[int, int], int]
+    arrivals: dict[tuple[int, int], int]
+
+    # wave: { work_id: vehicle_id }
+    pickups: dict[int, dict[int, int]]
+    deliveries: dict[int, dict[int, int]]
+
+    unmatched: list[UnmatchedWork]
+
+    def __init__(self, waves: Waves) -> None:
+        self.departures = {}
+        self.arrivals = {}
+
+        for w, wave in [ (1, waves.w1), (2, waves.w2), (3, waves.w3) ]:
+            for vs in wave.vehicles:
+                self.departures[(w, vs.id)] = vs.from_assembly_id
+                self.arrivals[(w, vs.id)] = vs.to_assembly_id
+
+        self.pickups = { 1: {}, 2: {} }
+        self.deliveries = { 2: {}, 3: {} }
+        self.unmatched = []
+
+    def add_tasks(self, wave: int, vehicle_id: int, tasks: list[Task]):
+        # wave_1의 delivery, wave_3의 pickup은 동일 차량으로 처리되므로 swap과 무관
+        for t in tasks:
+            if t.type == TaskType.pickup and wave in self.pickups:
+                self.pickups[wave][t.work_id] = vehicle_id
+            elif t.type == TaskType.delivery and wave in self.deliveries:
+                self.deliveries[wave][t.work_id] = vehicle_id
+
+    def plan(self, work_ids: Iterable[int], swap_1_2: dict[int, VehicleSwaps], swap_2_3: dict[int, VehicleSwaps]):
+        """
+        `work_ids` 순서대로 `swap_1_2`, `swap_2_3`의 down, up에 주문을 추가한다.
+        """
+        logger.debug('pickups %s', self.pickups)
+        logger.debug('deliveries %s', self.deliveries)
+
+        for wid in work_ids:
+
+            # wave_1에서 pickup 된 주문
+            if wid in self.pickups[1]:
+                v1 = self.pickups[1][wid]
+                a1 = self.arrivals[(1, v1)]
+
+                # wave_2에서 delivery 된 경우
+                if wid in self.deliveries[2]:
+                    v2 = self.deliveries[2][wid]
+                    a2 = self.departures[(2, v2)]
+
+                    # pickup 차량과 delivery 차량이 다른 경우
+                    if v1 != v2:
+                        # pickup 차량의 도착 위치와 delivery 차량의 출발 위치가 다름
+                        if a1 != a2:
+                            self.__unmatch(wid, v1, v2, f'work {wid} down at {a1} by {v1}, but up at {a2} by {v2}')
+                            continue
+
+                        # 1_2 에서 만나서 교환
+                        swap_1_2[v1].down.append(wid)
+                        swap_1_2[v2].up.append(wid)
+
+                # wave_3에서 delivery 된 경우
+                elif wid in self.deliveries[3]:
+                    v3 = self.deliveries[3][wid]
+                    a3 = self.departures[(3, v3)]
+
+                    # pickup 차량과 delivery 차량이 다른 경우
+                    if v1 != v3:
+                        a3_2 = self.departures.get((2, v3))
+                        a1_2 = self.arrivals.get((2, v1))
+
+                        # pickup 차량이 wave_1에 도착한 집결지와
+                        # delivery 차량이 wave_2에 출발한 집결지가 같으면
+                        # 1_2 에서 만나서 교환
+                        if a1 == a3_2:
+                            swap_1_2[v1].down.append(wid)
+                            swap_1_2[v3].up.append(wid)
+                        # pickup 차량이 wave_2에 도착한 집결지와
+                        # delivery 차량이 wave_3에 출발한 집결지가 같으면
+                        # 2_3 에서 만나서 교환
+                        elif a1_2 == a3:
+                            swap_2_3[v1].down.append(wid)
+                            swap_2_3[v3].up.append(wid)
+                        # 만나는 집결지가 존재하지 않음
+                        else:
+                            self.__unmatch(
+                                wid, v1, v3,
+                                f'work {wid} cannot match at ' +
+                                f'1_2 (down at {a1} by {v1}, up at {a3_2} by {v3}) and ' +
+                                f'2_3 (down at {a1_2} by {v1}, up at {a3} by {v3})',
+                            )
+
+            # wave_2에서 pickup 된 주문
+            elif wid in self.pickups[2]:
+                v2 = self.pickups[2][wid]
+                a2 = self.arrivals[(2, v2)]
+
+                # wave_3에서 delivery 된 경우
+                if wid in self.deliveries[3]:
+                    v3 = self.deliveries[3][wid]
+                    a3 = self.departures[(3, v3)]
+
+                    # pickup 차량과 delivery 차량이 다른 경우
+                    if v2 != v3:
+                        # pickup 차량의 도착 위치와 delivery 차량의 출발 위치가 다름
+                        if a2 != a3:
+                            self.__unmatch(wid, v2, v3, f'work {wid} down at {a2} by {v2}, but up at {a3} by {v3}')
+                            continue
+
+                        # 2_3 에서 만나서 교환
+                        swap_2_3[v2].down.append(wid)
+                        swap_2_3[v3].up.append(wid)
+
+    def __unmatch(self, work_id: int, pickup_vehicle_id: int, delivery_vehicle_id: int, detail: str):
+        logger.warning('%s', detail)
+
+        self.unmatched.append(UnmatchedWork(
+            work_id=work_id,
+            pickup_vehicle_id=pickup_vehicle_id,
+            delivery_vehicle_id=delivery_vehicle_id,
+            detail=detail,
+        ))
+
+# 주문을 처리하는 vroouty step
+JOB_STEP_TYPES = ('job', 'pickup', 'delivery')
+
+class StagePlan:
+    """
+    한 단계(first, second optimization)에서 vroouty에 보낸 request의 조건과 채택된 경로
+
+    step id는 `WorkHandler`의 key로 보관하므로 다음 계산에서 index가 달라져도 경로를 재사용할 수 있다.
+    """
+
+    # vroouty vehicle id: (time_window 외의 차량 조건, time_window)
+    vehicles: dict[int, tuple[str, tuple[int, int] | None]]
+
+    # work key: job(shipment) 조건, shipment는 pickup, delivery key 모두 같은 값
+    jobs: dict[tuple, str]
+
+    # vroouty vehicle id: route
+    routes: dict[int, dict]
+
+    def __init__(self, request: dict, work_handler: WorkHandler) -> None:
+        self.vehicles = {}
+        self.jobs = {}
+        self.routes = {}
+
+        for v in request['vehicles']:
+            condition = Fingerprint({ k: x for k, x in v.items() if k not in ('steps', 'time_window') })
+            time_window = tuple(v['time_window']) if 'time_window' in v else None
+            self.vehicles[v['id']] = (condition, time_window)
+
+        for j in request['jobs']:
+            self.jobs[work_handler.work_id(j['id'])] = Fingerprint({ k: x for k, x in j.items() if k != 'id' })
+
+        for sh in request['shipments']:
+            condition = Fingerprint({
+                **sh,
+                'pickup': { k: x for k, x in sh['pickup'].items() if k != 'id' },
+                'delivery': { k: x for k, x in sh['delivery'].items() if k != 'id' },
+            })
+            self.jobs[work_handler.work_id(sh['pickup']['id'])] = condition
+            self.jobs[work_handler.work_id(sh['delivery']['id'])] = condition
+
+    def set_routes(self, routes: list[dict], work_handler: WorkHandler):
+        for route in routes:
+            self.routes[route['vehicle']] = {
+                **route,
+                'steps': [
+                    { **step, 'id': work_handler.work_id(step['id']) } if step['type'] in JOB_STEP_TYPES else step
+                    for step in route['steps']
+                ],
+            }
+
 class OptimizationHandler:
+    algorithm: Algorithm
+
     vehicle_dict: dict[int, Vehicle]
     assembly_dict: dict[int, Assembly]
     work_dict: dict[int, Work]
@@ -325,7 +548,22 @@ class OptimizationHandler:
     swap_2_3_down: dict[int, int]
     swap_2_3_up: dict[int, int]
 
+    memo: dict[str, bytes]
+
+    # (wave, vehicle id): 이전 최적화 결과
+    previous_tasks: dict[tuple[int, int], list[Task]]
+
+    # 단계별 계획, `previous_plans`가 None이면 보관하지 않는다 (key: `plan_key`)
+    plans: dict[tuple, StagePlan]
+    previous_plans: dict[tuple, StagePlan] | None
+
     def __init__(self, request: Request) -> None:
+        self.algorithm = request.algorithm
+        self.memo = {}
+
+        self.plans = {}
+        self.previous_plans = None
+
         self.vehicle_dict = { v.id: v for v in request.vehicles }
         self.assembly_dict = { a.id: a for a in request.assemblies }
         self.work_dict = { w.id: w for w in request.works }
@@ -335,6 +573,12 @@ class OptimizationHandler:
 
         self.waves = Waves(request.schedules)
 
+        self.previous_tasks = {
+            (w, vs.id): vs.tasks
+            for w, wave in [(1, self.waves.w1), (2, self.waves.w2), (3, self.waves.w3)]
+            for vs in wave.vehicles
+        }
+
         self.wave_1_done_pickups = {}
         self.wave_1_done_deliveries = {}
         self.wave_1_departed = set()
@@ -414,7 +658,7 @@ class OptimizationHandler:
         # 주문에 사용된 skill 중, 모든 차량이 가지고 있는 skill을 제거한다
         used_skills_union = used_skills_union.difference(used_skills_intersects)
 
-        print('prune:', 'intersects:', used_skills_intersects, 'difference:', used_skills_union)
+        logger.debug('prune: intersects: %s difference: %s', used_skills_intersects, used_skills_union)
 
         for i, j in enumerate(request['jobs']):
             request['jobs'][i]['skills'] = list(used_skills_union.intersection(j['skills']))
@@ -425,51 +669,393 @@ class OptimizationHandler:
         for i, v in enumerate(request['vehicles']):
             request['vehicles'][i]['skills'] = list(used_skills_union.intersection(v['skills']))
 
+    def cap_end_time(self, request: dict, end_time: int | None, minimum_time_vehicles: set[int]) -> dict:
+        # minimum_time_vehicles의 time_window 종료 시간을 end_time으로 제한한 request
+        # end_time is None 이면 제한하지 않는다
+        if end_time is None:
+            return request
+
+        vehicles = []
+
+        for v in request['vehicles']:
+            if v['id'] in minimum_time_vehicles:
+                tw = v['time_window']
+
+                if tw[0] > end_time:
+                    tw = (tw[0], tw[0])
+                else:
+                    tw = (tw[0], end_time)
+
+                v = { **v, 'time_window': tw }
+                logger.debug('\t vehicle %s tw: %s', v['id'], tw)
+
+            vehicles.append(v)
+
+        return { **request, 'vehicles': vehicles }
+
+    def attach_warm_start(self, request: dict):
+        """
+        이전 최적화 결과(`previous_tasks`)의 처리 순서를 request의 차량별 `steps`로 추가한다.
+
+        request에 포함된 job, shipment만 사용하고,
+        shipment는 같은 차량이 pickup, delivery 순서로 처리한 경우에만 사용한다.
+        """
+        job_steps: dict[tuple[TaskType, int], dict] = {}
+        shipment_steps: dict[tuple[TaskType, int], dict] = {}
+
+        for j in request['jobs']:
+            key = self.work_handler.work_id(j['id'])
+            if key[0] == 'pickup':
+                job_steps[(TaskType.pickup, key[1])] = { 'type': 'job', 'id': j['id'] }
+            elif key[0] == 'delivery':
+                job_steps[(TaskType.delivery, key[1])] = { 'type': 'job', 'id': j['id'] }
+
+        for sh in request['shipments']:
+            pickup_key = self.work_handler.work_id(sh['pickup']['id'])
+            delivery_key = self.work_handler.work_id(sh['delivery']['id'])
+            if pickup_key[0] == 'shipment_pickup' and delivery_key[0] == 'shipment_delivery':
+                shipment_steps[(TaskType.pickup, pickup_key[1])] = { 'type': 'pickup', 'id': sh['pickup']['id'] }
+                shipment_steps[(TaskType.delivery, delivery_key[1])] = { 'type': 'delivery', 'id': sh['delivery']['id'] }
+
+        used: set[int] = set()
+
+        for vehicle in request['vehicles']:
+            w, vid = self.waves.vehicle_index_to_id(vehicle['id'])
+
+            tasks = [
+                t for t in self.previous_tasks.get((w, vid), [])
+                if not t.done and t.work_id is not None and t.type in [TaskType.pickup, TaskType.delivery]
+            ]
+
+            picked_up: set[int] = set()
+            shipped: set[int] = set()
+            for t in tasks:
+                if t.type == TaskType.pickup:
+                    picked_up.add(t.work_id)
+                elif t.work_id in picked_up:
+                    shipped.add(t.work_id)
+
+            steps = []
+            for t in tasks:
+                key = (t.type, t.work_id)
+
+                if t.work_id in shipped and key in shipment_steps:
+                    step = shipment_steps[key]
+                elif key in job_steps:
+                    step = job_steps[key]
+                else:
+                    continue
+
+                if step['id'] in used:
+                    continue
+
+                used.add(step['id'])
+                steps.append(step)
+
+            if len(steps) > 0:
+                vehicle['steps'] = steps
+
+    def without_warm_start(self, request: dict) -> dict:
+        return {
+            **request,
+            'vehicles': [ { k: v for k, v in vehicle.items() if k != 'steps' } for vehicle in request['vehicles'] ],
+        }
+
+    def use_previous_response(self, response: Response, changed: set[int] = set()):
+        """
+        이전 최적화 결과로 `VehicleSchedule.tasks` 대신 `response`를 사용한다. (warm start, 종료 시간 탐색)
+
+        `changed` work를 처리하던 차량은 `VehicleSchedule.tasks`를 그대로 사용한다.
+        """
+        for w, wave_tasks in [(1, response.wave_1), (2, response.wave_2), (3, response.wave_3)]:
+            for vt in wave_tasks:
+                if any(t.work_id in changed for t in vt.tasks):
+                    continue
+                self.previous_tasks[(w, vt.vehicle_id)] = vt.tasks
+
+    def previous_end_time(self, wave: int) -> int | None:
+        # 이전 최적화 결과에서 wave가 끝나는 시간
+        etas = [ tasks[-1].eta for (w, _), tasks in self.previous_tasks.items() if w == wave and len(tasks) > 0 ]
+
+        if len(etas) == 0:
+            return None
+
+        return max(etas)
+
+    def plan_key(self, stopover_time: dict[int, int] | None = None) -> tuple:
+        # first optimization: ('first',), second optimization: ('second', 집결 시간)
+        if stopover_time is None:
+            return ('first',)
+        return ('second', tuple(sorted(stopover_time.items())))
+
+    def accept_plan(self, stopover_time: dict[int, int] | None):
+        # 채택된 계획만 남기고, second optimization 계획은 집결 시간이 달라진 다음 계산에서도 차량별로 재사용한다
+        plans = { k: plan for k, plan in self.plans.items() if k == self.plan_key() }
+
+        key = self.plan_key(stopover_time)
+        if stopover_time is not None and key in self.plans:
+            plans[('second',)] = self.plans[key]
+
+        self.plans = plans
+
+    def reusable_routes(self, request: dict, previous: StagePlan, current: StagePlan) -> dict[int, dict | None]:
+        """
+        `previous` 계획의 경로를 그대로 사용할 수 있는 vroouty vehicle id: route (배차되지 않았던 차량은 None)
+
+        차량 조건과 경로상의 주문이 모두 그대로이고 이전 계획의 출발 시간에 출발할 수 있는 차량만 재사용하며,
+        바뀌거나 새로 추가된 주문을 처리할 수 있는 차량은 다시 계산한다.
+        """
+        changed = { k for k, condition in current.jobs.items() if previous.jobs.get(k) != condition }
+
+        reusable: dict[int, dict | None] = {}
+
+        for vid, (condition, time_window) in current.vehicles.items():
+            if vid not in previous.vehicles:
+                continue
+
+            previous_condition, previous_time_window = previous.vehicles[vid]
+            if condition != previous_condition or (time_window is None) != (previous_time_window is None):
+                continue
+
+            route = previous.routes.get(vid)
+
+            # 종료 시간은 같고, 시작 시간은 이전 계획의 출발 시간보다 늦지 않아야 한다
+            if time_window is not None:
+                if time_window[1] != previous_time_window[1]:
+                    continue
+                if route is not None and time_window[0] > route['steps'][0]['arrival']:
+                    continue
+
+            if route is not None and any(
+                step['id'] in changed or step['id'] not in current.jobs
+                for step in route['steps'] if step['type'] in JOB_STEP_TYPES
+            ):
+                continue
+
+            reusable[vid] = route
+
+        vehicle_skills = { v['id']: set(v['skills']) for v in request['vehicles'] }
+
+        changed_skills = [
+            set(j['skills']) for j in request['jobs'] if self.work_handler.work_id(j['id']) in changed
+        ] + [
+            set(sh['skills']) for sh in request['shipments'] if self.work_handler.work_id(sh['pickup']['id']) in changed
+        ]
+
+        for vid in list(reusable):
+            if any(skills <= vehicle_skills[vid] for skills in changed_skills):
+                del reusable[vid]
+
+        return reusable
+
+    def restore_route(self, route: dict) -> dict:
+        # `StagePlan`에 보관된 경로의 step id를 현재 index로 변환
+        return {
+            **route,
+            'steps': [
+                { **step, 'id': self.work_handler.index_of(step['id']) } if step['type'] in JOB_STEP_TYPES else dict(step)
+                for step in route['steps']
+            ],
+        }
+
+    async def solve_stage(
+            self,
+            key: tuple,
+            request: dict,
+            start: int,
+            minimum_time_vehicles: set[int],
+            must_handle_ids: set[int],
+            hint: int | None = None,
+        ) -> dict:
+        """
+        `minimum_end_time`으로 계산하고, `previous_plans`가 주어지면 계획을 `plans[key]`에 보관한다.
+
+        같은 단계의 이전 계획이 있으면 `reusable_routes`의 차량은 이전 경로를 그대로 사용하고,
+        나머지 차량과 재사용하지 않는 주문만 다시 계산한다.
+        """
+        if self.previous_plans is None:
+            return await self.minimum_end_time(request, start, minimum_time_vehicles, must_handle_ids, hint)
+
+        plan = StagePlan(request, self.work_handler)
+
+        previous = self.previous_plans.get(key) or self.previous_plans.get(key[:1])
+        reusable = self.reusable_routes(request, previous, plan) if previous is not None else {}
+
+        if len(reusable) == 0:
+            response = await self.minimum_end_time(request, start, minimum_time_vehicles, must_handle_ids, hint)
+
+        else:
+            routes = [ self.restore_route(route) for route in reusable.values() if route is not None ]
+            handled = { step['id'] for route in routes for step in route['steps'] if step['type'] in JOB_STEP_TYPES }
+
+            jobs = [ j for j in request['jobs'] if j['id'] not in handled ]
+            shipments = [ sh for sh in request['shipments'] if sh['pickup']['id'] not in handled ]
+            vehicles = [ v for v in request['vehicles'] if v['id'] not in reusable ]
+
+            logger.info('%s: %d/%d vehicles re-solved', key[0], len(vehicles), len(request['vehicles']))
+
+            ids = { j['id'] for j in jobs } | { sh[p]['id'] for sh in shipments for p in ('pickup', 'delivery') }
+
+            # 다른 차량이 처리하게 된 주문의 초기 경로 제외
+            for i, v in enumerate(vehicles):
+                if 'steps' in v:
+                    steps = [ step for step in v['steps'] if step['id'] in ids ]
+                    vehicles[i] = { **v, 'steps': steps } if len(steps) > 0 else { k: x for k, x in v.items() if k != 'steps' }
+
+            if len(vehicles) > 0:
+                # 재사용하는 차량이 늦게 끝나면 다시 계산하는 차량도 그때까지 사용할 수 있다
+                end_times = [ route['steps'][-1]['arrival'] for route in routes if route['vehicle'] in minimum_time_vehicles ]
+
+                response = await self.minimum_end_time(
+                    { **request, 'jobs': jobs, 'shipments': shipments, 'vehicles': vehicles },
+                    max([ start, *end_times ]), minimum_time_vehicles, must_handle_ids, hint,
+                )
+            else:
+                response = {
+                    'routes': [],
+                    'unassigned': [ { 'id': id } for id in sorted(ids) ],
+                }
+
+            response = { **response, 'routes': sorted(response['routes'] + routes, key=lambda route: route['vehicle']) }
+
+        plan.set_routes(response['routes'], self.work_handler)
+        self.plans[key] = plan
+
+        return response
+
     async def minimum_end_time(
             self,
             request: dict,
             start: int,
             minimum_time_vehicles: set[int],
             must_handle_ids: set[int],
+            hint: int | None = None,
         ):
         self.prune_skills(request)
 
-        best_response: dict = {}
+        search = self.algorithm.end_time_search
+
+        async def solve(end_time: int | None) -> dict:
+            capped = self.cap_end_time(request, end_time, minimum_time_vehicles)
+
+            status, response = await vroouty.Post(capped, memo=self.memo)
+
+            # 이전 계획이 현재 조건(시간 제한 등)에서 불가능한 경우
+            if status != 200 and self.algorithm.warm_start:
+                logger.info('\t warm start rejected: %s', response)
+                status, response = await vroouty.Post(self.without_warm_start(capped), memo=self.memo)
+
+            if status != 200:
+                raise HTTPException(500, detail=response)
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('\t unassigned: %s', [u['id'] for u in response['unassigned']])
 
-        original_vehicles = [v.copy() for v in request['vehicles']]
+            return response
 
-        time_threshold = 1000
+        def feasible(response: dict) -> bool:
+            return not any([u['id'] in must_handle_ids for u in response['unassigned']])
+
+        best_response: dict = {}
 
         l, r = start, start + 86400
 
-        print('\t', 'minimum_time_vehicles:', minimum_time_vehicles)
-        print('\t', 'must_handle:', must_handle_ids)
+        logger.debug('\t minimum_time_vehicles: %s', minimum_time_vehicles)
+        logger.debug('\t must_handle: %s', must_handle_ids)
 
-        while l + time_threshold < r:
-            c = int((l + r)/2)
+        if search.type in [EndTimeSearchType.bracketed, EndTimeSearchType.kary]:
+
+            # 종료 시간 제한 없이 계산하여 반드시 처리해야 하는 주문이 미배차되면
+            # 어떤 종료 시간으로도 처리할 수 없으므로 그대로 반환
+            response = await solve(None)
+
+            if not feasible(response):
+                return response
+
+            best_response = response
+
+            # 제한 없이 계산된 경로의 실제 종료 시간은 항상 가능한 상한
+            end_times = [
+                route['steps'][-1]['arrival'] for route in response['routes']
+                if route['vehicle'] in minimum_time_vehicles
+            ]
+            r = min(r, max(end_times, default=l))
+
+            logger.debug('%s %s %s hint: %s', l, r, search.type.value, hint)
+
+        if search.type == EndTimeSearchType.kary:
+
+            k = search.parallelism
+
+            # 첫 round는 이전 계획의 종료 시간 주변을 resolution 간격으로 계산
+            if hint is not None and l < hint:
+                anchor = min(hint, r)
+                offsets = range(-(k // 2), k - k // 2) if anchor < r else range(-k, 0)
+                cs = [ anchor + search.resolution * j for j in offsets ]
+            else:
+                cs = []
+
+            while l + search.resolution < r:
+                cs = sorted({ c for c in cs if l < c < r })
+
+                if len(cs) == 0:
+                    cs = sorted({ l + (r - l) * i // (k + 1) for i in range(1, k + 1) } - {l, r})
+
+                logger.debug('%s %s %s', l, cs, r)
+
+                responses = await concurrency.gather([ solve(c) for c in cs ])
 
-            print(l, c, r)
+                # 가능한 가장 작은 종료 시간과 그보다 작은 불가능한 종료 시간으로 구간을 좁힌다
+                for c, response in zip(cs, responses):
+                    if feasible(response):
+                        r = c
+                        best_response = response
+                        break
+                    l = c
 
-            for i, v in enumerate(request['vehicles']):
-                if v['id'] in minimum_time_vehicles:
-                    tw = original_vehicles[i]['time_window']
+                cs = []
 
-                    if tw[0] > c:
-                        tw = (tw[0], tw[0])
+            return best_response
+
+        if search.type == EndTimeSearchType.bracketed:
+
+            # 이전 계획의 종료 시간 근처에서 resolution 단위로 간격을 넓혀가며 구간을 좁힌다
+            if hint is not None and l < hint:
+                c, step, direction = min(hint, r), search.resolution, None
+
+                # hint가 이미 가능한 상한 이상이면 상한에서부터 줄여나간다
+                if c == r:
+                    c, direction = r - step, 'down'
+
+                while l + search.resolution < r and l < c < r:
+                    logger.debug('%s %s %s', l, c, r)
+
+                    response = await solve(c)
+
+                    if feasible(response):
+                        r = c
+                        best_response = response
+                        if direction == 'up':
+                            break
+                        direction = 'down'
+                        c = r - step
                     else:
-                        tw = (tw[0], c)
+                        l = c
+                        if direction == 'down':
+                            break
+                        direction = 'up'
+                        c = l + step
 
-                    request['vehicles'][i]['time_window'] = tw
-                    print('\t', 'vehicle', v['id'], 'tw:', tw)
+                    step *= 2
 
-            status, response = await vroouty.Post(request)
+        while l + search.resolution < r:
+            c = int((l + r)/2)
 
-            if status != 200:
-                raise HTTPException(500, detail=response)
+            logger.debug('%s %s %s', l, c, r)
 
-            print('\t', 'unassigned:', [u['id'] for u in response['unassigned']])
+            response = await solve(c)
 
-            if any([u['id'] in must_handle_ids for u in response['unassigned']]):
+            if not feasible(response):
                 l = c
             else:
                 r = c
@@ -481,11 +1067,17 @@ class OptimizationHandler:
 
         # calculate osrm
         if len(tasks) > 1:
-            status, response = await osrm.GetRoutes(profile, [t.location for t in tasks])
-            if status == 200:
-                for i, leg in enumerate(response['routes'][0]['legs']):
-                    tasks[i+1].duration = leg['duration']
-                    tasks[i+1].distance = leg['distance']
+            legs = await osrm.GetLegs(profile, [t.location for t in tasks])
+            for i, leg in enumerate(legs):
+                if leg is not None:
+                    tasks[i+1].duration, tasks[i+1].distance = leg
+
+    async def setup_route_data(self, route_data_tasks: list[tuple[str, list[Task]]]):
+        # 차량별 osrm 요청을 동시에 처리
+        await concurrency.gather(
+            [ self.setup_route_data_for_tasks(profile, tasks) for profile, tasks in route_data_tasks ],
+            limit=osrm.MAX_CONCURRENCY,
+        )
 
     async def first_optimization(self, request: Request):
 
@@ -510,11 +1102,11 @@ class OptimizationHandler:
                     if running and next_task.work_id is not None:
                         handling_work = self.work_dict[next_task.work_id]
                         if next_task.type == TaskType.pickup:
-                            print(f'fo waiting pickup {handling_work.id} changed to handle_pickup, by vehicle {vs.id}')
+                            logger.debug('fo waiting pickup %s changed to handle_pickup, by vehicle %s', handling_work.id, vs.id)
                             handling_work.status.type = WorkStatusType.handle_pickup
                             handling_work.status.vehicle_id = vs.id
                         if next_task.type == TaskType.delivery:
-                            print(f'fo waiting delivery {handling_work.id} changed to handle_delivery, by vehicle {vs.id}')
+                            logger.debug('fo waiting delivery %s changed to handle_delivery, by vehicle %s', handling_work.id, vs.id)
                             handling_work.status.type = WorkStatusType.handle_delivery
                             handling_work.status.vehicle_id = vs.id
 
@@ -561,7 +1153,7 @@ class OptimizationHandler:
                         'skills': self.skills.get_task_skills_wave_vehicles([(1, vs.id)]),
                     })
 
-                print('fo w1 vehicle', vehicle)
+                logger.debug('fo w1 vehicle %s', vehicle)
 
         for vs in self.waves.w2.vehicles:
             v = self.vehicle_dict[vs.id]
@@ -595,7 +1187,7 @@ class OptimizationHandler:
 
             fo_minimum_time_vehicles.add(vehicle['id'])
 
-            print('fo w2 vehicle', vehicle)
+            logger.debug('fo w2 vehicle %s', vehicle)
 
         for wid, w in self.work_dict.items():
 
@@ -695,7 +1287,7 @@ class OptimizationHandler:
 
                 fo_jobs.append(pickup_job)
                 fo_must_handle_ids.add(pickup_job['id'])
-                print('fo', 'p', wid, pickup_job)
+                logger.debug('fo p %s %s', wid, pickup_job)
 
             if has_delivery:
 
@@ -718,7 +1310,7 @@ class OptimizationHandler:
                     fo_must_handle_ids.add(delivery_job['id'])
 
                 fo_jobs.append(delivery_job)
-                print('fo', 'd', wid, delivery_job)
+                logger.debug('fo d %s %s', wid, delivery_job)
 
             if has_shipment:
 
@@ -752,7 +1344,7 @@ class OptimizationHandler:
                     shipment['pickup']['service'] = 0
 
                 fo_shipments.append(shipment)
-                print('fo', 's', wid, shipment)
+                logger.debug('fo s %s %s', wid, shipment)
 
         fo_request = {
             'jobs': fo_jobs,
@@ -766,7 +1358,13 @@ class OptimizationHandler:
             }
         }
 
-        fo_response = await self.minimum_end_time(fo_request, self.waves.w2.start_time, fo_minimum_time_vehicles, fo_must_handle_ids)
+        if self.algorithm.warm_start:
+            self.attach_warm_start(fo_request)
+
+        fo_response = await self.solve_stage(
+            self.plan_key(), fo_request, self.waves.w2.start_time, fo_minimum_time_vehicles, fo_must_handle_ids,
+            hint=self.previous_end_time(2),
+        )
 
         # 반드시 포함되어야 하는 주문이 미배차된 경우
         # 기존에 배차되었던 task들의 pickup을 그대로 적용
@@ -810,7 +1408,7 @@ class OptimizationHandler:
 
                     elif s['type'] == 'end' and w == 2:
                         arrival = s['arrival']
-                        print(f'v{v_idx} arrives {assembly.id} at {arrival}')
+                        logger.debug('v%s arrives %s at %s', v_idx, assembly.id, arrival)
                         if (assembly.id not in self.wave_2_stopover_times) or (self.wave_2_stopover_times[assembly.id] < arrival):
                             self.wave_2_stopover_times[assembly.id] = arrival
 
@@ -825,24 +1423,20 @@ class OptimizationHandler:
                         elif w == 2 and wid in self.wave_2_pickups and self.wave_2_pickups[wid] == vid:
                             self.wave_2_shipments[wid] = vid
 
-        # DEBUG
-        # with open('/data/logs/roouty-dynamic-engine/fo_response.json', 'w') as f:
-        #     json.dump(fo_response, f, ensure_ascii=False)
-
         # wave 2 집결시간이 존재하지 않는 경우 시작 + 3시간으로 고정 적용
         for aid, a in self.assembly_dict.items():
             if aid not in self.wave_2_stopover_times:
                 self.wave_2_stopover_times[aid] = self.waves.w2.start_time + 10800
 
-        print('w1-d-p', self.wave_1_done_pickups)
-        print('w1-d-d', self.wave_1_done_deliveries)
-        print('w1-p', self.wave_1_pickups)
-        print('w1-sm', self.wave_1_shipments)
-        print('s12-d', self.swap_1_2_down)
-        print('s12-u', self.swap_1_2_up)
-        print('w2-p', self.wave_2_pickups)
-        print('w2-sm', self.wave_2_shipments)
-        print('w2-sot', self.wave_2_stopover_times)
+        logger.debug('w1-d-p %s', self.wave_1_done_pickups)
+        logger.debug('w1-d-d %s', self.wave_1_done_deliveries)
+        logger.debug('w1-p %s', self.wave_1_pickups)
+        logger.debug('w1-sm %s', self.wave_1_shipments)
+        logger.debug('s12-d %s', self.swap_1_2_down)
+        logger.debug('s12-u %s', self.swap_1_2_up)
+        logger.debug('w2-p %s', self.wave_2_pickups)
+        logger.debug('w2-sm %s', self.wave_2_shipments)
+        logger.debug('w2-sot %s', self.wave_2_stopover_times)
 
     async def second_optimization(self, request: Request, stopover_time: dict[int, int]):
 
@@ -899,7 +1493,7 @@ class OptimizationHandler:
                 if tw_start < tw_end:
                     vehicle['time_window'] = (tw_start, tw_end)
                     so_vehicles.append(vehicle)
-                    print('so w1 vehicle', vehicle)
+                    logger.debug('so w1 vehicle %s', vehicle)
 
         for vs in self.waves.w2.vehicles:
             v = self.vehicle_dict[vs.id]
@@ -929,7 +1523,7 @@ class OptimizationHandler:
 
             vehicle['time_window'] = (tw_start, tw_end)
             so_vehicles.append(vehicle)
-            print('so w2 vehicle', vehicle)
+            logger.debug('so w2 vehicle %s', vehicle)
 
         for vs in self.waves.w3.vehicles:
             v = self.vehicle_dict[vs.id]
@@ -954,7 +1548,7 @@ class OptimizationHandler:
 
                 so_vehicles.append(vehicle)
                 so_minimum_time_vehicles.add(vehicle['id'])
-                print('so w3 vehicle', vehicle)
+                logger.debug('so w3 vehicle %s', vehicle)
             # stopover_time이 없으면 차량 미사용
 
         # status in [wait, wave_1]일 때에는 주문 상태와 권역,
@@ -1071,7 +1665,7 @@ class OptimizationHandler:
 
                     so_jobs.append(pickup_job)
                     so_must_handle_ids.add(pickup_job['id'])
-                    print('so', 'p', wid, pickup_job)
+                    logger.debug('so p %s %s', wid, pickup_job)
 
                 if has_delivery:
 
@@ -1089,7 +1683,7 @@ class OptimizationHandler:
 
                     so_jobs.append(delivery_job)
                     so_must_handle_ids.add(delivery_job['id'])
-                    print('so', 'd', wid, delivery_job)
+                    logger.debug('so d %s %s', wid, delivery_job)
 
                 if has_shipment:
 
@@ -1125,7 +1719,7 @@ class OptimizationHandler:
                     so_shipments.append(shipment)
                     so_must_handle_ids.add(shipment['pickup']['id'])
                     so_must_handle_ids.add(shipment['delivery']['id'])
-                    print('so', 's', wid, shipment)
+                    logger.debug('so s %s %s', wid, shipment)
 
         # status in [stopover]일 때에는 swap_1_2의 up, down을 고정한다
         elif request.current_status in [CurrentStatus.stopover]:
@@ -1221,7 +1815,7 @@ class OptimizationHandler:
 
                     so_jobs.append(pickup_job)
                     so_must_handle_ids.add(pickup_job['id'])
-                    print('so', 'p', wid, pickup_job)
+                    logger.debug('so p %s %s', wid, pickup_job)
 
                 if has_delivery:
 
@@ -1239,7 +1833,7 @@ class OptimizationHandler:
 
                     so_jobs.append(delivery_job)
                     so_must_handle_ids.add(delivery_job['id'])
-                    print('so', 'd', wid, delivery_job)
+                    logger.debug('so d %s %s', wid, delivery_job)
 
                 if has_shipment:
 
@@ -1275,7 +1869,7 @@ class OptimizationHandler:
                     so_shipments.append(shipment)
                     so_must_handle_ids.add(shipment['pickup']['id'])
                     so_must_handle_ids.add(shipment['delivery']['id'])
-                    print('so', 's', wid, shipment)
+                    logger.debug('so s %s %s', wid, shipment)
 
         # TODO
         else:
@@ -1293,9 +1887,65 @@ class OptimizationHandler:
             }
         }
 
-        # print(json.dumps(so_request, ensure_ascii=False))
+        if self.algorithm.warm_start:
+            self.attach_warm_start(so_request)
+
+        return await self.solve_stage(
+            self.plan_key(stopover_time), so_request, self.waves.w2.start_time, so_minimum_time_vehicles, so_must_handle_ids,
+            hint=self.previous_end_time(3),
+        )
+
+    def make_tasks(
+            self,
+            route: dict,
+            departure_assembly_id: int | None = None,
+            arrival_assembly_id: int | None = None,
+            terminals: bool = True,
+            ) -> list[Task]:
+        """
+        vroouty route의 step들을 순서대로 task로 변환한다.
+
+        engine 결과는 검증할 필요가 없으므로 `model_construct`로 생성하되 정수 field는 `int`로 변환하고,
+        `terminals=True`이면 start, end step을 각각 출발, 도착 task로 추가한다.
+        """
+        tasks: list[Task] = []
+
+        for step in route['steps']:
+            step_type = step['type']
+            location = (step['location'][0], step['location'][1])
+
+            if step_type in ('job', 'pickup', 'delivery'):
+                p, wid = self.work_handler.work_id(step['id'])
+
+                if p in ('pickup', 'shipment_pickup'):
+                    task_type = TaskType.pickup
+                elif p in ('delivery', 'shipment_delivery'):
+                    task_type = TaskType.delivery
+                else:
+                    continue
+
+                tasks.append(Task.model_construct(
+                    work_id=wid,
+                    type=task_type,
+                    eta=int(step['arrival']),
+                    setup_time=int(step['setup']),
+                    service_time=int(step['service']),
+                    assembly_id=None,
+                    location=location,
+                ))
 
-        return await self.minimum_end_time(so_request, self.waves.w2.start_time, so_minimum_time_vehicles, so_must_handle_ids)
+            elif terminals and step_type in ('start', 'end'):
+                tasks.append(Task.model_construct(
+                    work_id=None,
+                    type=TaskType.departure if step_type == 'start' else TaskType.arrival,
+                    eta=int(step['arrival']),
+                    setup_time=int(step['setup']),
+                    service_time=int(step['service']),
+                    assembly_id=departure_assembly_id if step_type == 'start' else arrival_assembly_id,
+                    location=location,
+                ))
+
+        return tasks
 
     async def make_response(self, request: Request, response: dict, stopover_time: dict[int, int]) -> Response:
 
@@ -1307,11 +1957,10 @@ class OptimizationHandler:
         swap_2_3_dict: dict[int, VehicleSwaps] = {}
         wave_3_dict: dict[int, VehicleTasks] = {}
 
-        # work_id: [vehicle_id, assembly_id]
-        wave_1_p: dict[int, tuple[int, int]] = {}
-        wave_2_p: dict[int, tuple[int, int]] = {}
-        wave_2_d: dict[int, tuple[int, int]] = {}
-        wave_3_d: dict[int, tuple[int, int]] = {}
+        swap_planner = SwapPlanner(self.waves)
+
+        # osrm 구간 정보는 모든 wave의 task를 모은 뒤 한 번에 계산
+        route_data_tasks: list[tuple[str, list[Task]]] = []
 
         for vs in self.waves.w1.vehicles:
             v = self.vehicle_dict[vs.id]
@@ -1358,41 +2007,12 @@ class OptimizationHandler:
 
             if vehicle_index in routes_dict:
 
-                routes = routes_dict[vehicle_index]
+                for task in self.make_tasks(routes_dict[vehicle_index], terminals=False):
+                    if task.type == TaskType.pickup and self.work_dict[task.work_id].status.type == WorkStatusType.assembly:
+                        task.done = True
+                        departure_done = True
 
-                for step in routes['steps']:
-                    eta = step['arrival']
-                    setup_time = step['setup']
-                    service_time = step['service']
-                    location = (step['location'][0], step['location'][1])
-
-                    if step['type'] in ['job', 'pickup', 'delivery']:
-                        p, wid = self.work_handler.work_id(step['id'])
-                        if p in ['pickup', 'shipment_pickup']:
-                            done = self.work_dict[wid].status.type == WorkStatusType.assembly
-                            tasks.append(Task(
-                                work_id=wid,
-                                type=TaskType.pickup,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                                done=done,
-                            ))
-                            if done:
-                                departure_done = True
-
-                        elif p in ['delivery', 'shipment_delivery']:
-                            tasks.append(Task(
-                                work_id=wid,
-                                type=TaskType.delivery,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                            ))
+                    tasks.append(task)
 
             else:
 
@@ -1451,22 +2071,15 @@ class OptimizationHandler:
                     done=vs.id in self.wave_1_arrived,
                 ))
 
-            pickup_set: set[int] = set()
-
-            for t in tasks:
-                if t.type == TaskType.pickup:
-                    pickup_set.add(t.work_id)
-
-            for wid in pickup_set:
-                wave_1_p[wid] = (vs.id, vs.to_assembly_id)
-
-            await self.setup_route_data_for_tasks(v.profile.value, tasks)
+            swap_planner.add_tasks(1, vs.id, tasks)
 
             wave_1_dict[vs.id] = VehicleTasks(
                 vehicle_id=vs.id,
                 tasks=tasks,
             )
 
+            route_data_tasks.append((v.profile.value, wave_1_dict[vs.id].tasks))
+
         for vs in self.waves.w2.vehicles:
             v = self.vehicle_dict[vs.id]
 
@@ -1483,59 +2096,7 @@ class OptimizationHandler:
             vehicle_index = self.waves.w2.vehicle_id_to_index(vs.id)
 
             if vehicle_index in routes_dict:
-
-                routes = routes_dict[vehicle_index]
-
-                for step in routes['steps']:
-                    eta = step['arrival']
-                    setup_time = step['setup']
-                    service_time = step['service']
-                    location = (step['location'][0], step['location'][1])
-
-                    if step['type'] == 'start':
-                        tasks.append(Task(
-                            work_id=None,
-                            type=TaskType.departure,
-                            eta=eta,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=vs.from_assembly_id,
-                            location=location,
-                        ))
-
-                    if step['type'] in ['job', 'pickup', 'delivery']:
-                        p, wid = self.work_handler.work_id(step['id'])
-                        if p in ['pickup', 'shipment_pickup']:
-                            tasks.append(Task(
-                                work_id=wid,
-                                type=TaskType.pickup,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                            ))
-                        elif p in ['delivery', 'shipment_delivery']:
-                            tasks.append(Task(
-                                work_id=wid,
-                                type=TaskType.delivery,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                            ))
-
-                    elif step['type'] == 'end':
-                        tasks.append(Task(
-                            work_id=None,
-                            type=TaskType.arrival,
-                            eta=eta,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=vs.to_assembly_id,
-                            location=location,
-                        ))
+                tasks = self.make_tasks(routes_dict[vehicle_index], vs.from_assembly_id, vs.to_assembly_id)
 
             from_assembly = self.assembly_dict[vs.from_assembly_id]
             to_assembly = self.assembly_dict[vs.to_assembly_id]
@@ -1558,28 +2119,15 @@ class OptimizationHandler:
                     location=to_assembly.location,
                 ))
 
-            pickup_set: set[int] = set()
-            delivery_set: set[int] = set()
-
-            for t in tasks:
-                if t.type == TaskType.pickup:
-                    pickup_set.add(t.work_id)
-                elif t.type == TaskType.delivery:
-                    delivery_set.add(t.work_id)
-
-            for wid in pickup_set:
-                wave_2_p[wid] = (vs.id, vs.to_assembly_id)
-
-            for wid in delivery_set:
-                wave_2_d[wid] = (vs.id, vs.from_assembly_id)
-
-            await self.setup_route_data_for_tasks(v.profile.value, tasks)
+            swap_planner.add_tasks(2, vs.id, tasks)
 
             wave_2_dict[vs.id] = VehicleTasks(
                 vehicle_id=vs.id,
                 tasks=tasks,
             )
 
+            route_data_tasks.append((v.profile.value, wave_2_dict[vs.id].tasks))
+
         for vs in self.waves.w3.vehicles:
             v = self.vehicle_dict[vs.id]
 
@@ -1588,160 +2136,20 @@ class OptimizationHandler:
             vehicle_index = self.waves.w3.vehicle_id_to_index(vs.id)
 
             if vehicle_index in routes_dict:
+                tasks = self.make_tasks(routes_dict[vehicle_index], vs.from_assembly_id, None)
 
-                routes = routes_dict[vehicle_index]
-
-                for step in routes['steps']:
-                    eta = step['arrival']
-                    setup_time = step['setup']
-                    service_time = step['service']
-                    location = (step['location'][0], step['location'][1])
-
-                    if step['type'] == 'start':
-                        tasks.append(Task(
-                            work_id=None,
-                            type=TaskType.departure,
-                            eta=eta,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=vs.from_assembly_id,
-                            location=location,
-                        ))
-
-                    if step['type'] in ['job', 'pickup', 'delivery']:
-                        p, wid = self.work_handler.work_id(step['id'])
-                        if p in ['pickup', 'shipment_pickup']:
-                            tasks.append(Task(
-                                work_id=wid,
-                                type=TaskType.pickup,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                            ))
-                        elif p in ['delivery', 'shipment_delivery']:
-                            tasks.append(Task(
-                                work_id=wid,
-                                type=TaskType.delivery,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                            ))
-
-                    elif step['type'] == 'end':
-                        tasks.append(Task(
-                            work_id=None,
-                            type=TaskType.arrival,
-                            eta=eta,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=None,
-                            location=location,
-                        ))
-
-            delivery_set: set[int] = set()
-
-            for t in tasks:
-                if t.type == TaskType.delivery:
-                    delivery_set.add(t.work_id)
-
-            for wid in delivery_set:
-                wave_3_d[wid] = (vs.id, vs.from_assembly_id)
-
-            await self.setup_route_data_for_tasks(v.profile.value, tasks)
+            swap_planner.add_tasks(3, vs.id, tasks)
 
             wave_3_dict[vs.id] = VehicleTasks(
                 vehicle_id=vs.id,
                 tasks=tasks,
             )
 
-        print('wave_1_p', wave_1_p)
-        print('wave_2_p', wave_2_p)
-        print('wave_2_d', wave_2_d)
-        print('wave_3_d', wave_3_d)
-
-        for wid, w in self.work_dict.items():
-
-            # wave_1에서 pickup 된 주문
-            if wid in wave_1_p:
-                v1, a1 = wave_1_p[wid]
-
-                # wave_1에서 delivery 된 경우
-                # 동일 차량으로 처리되므로 not considered in swap
-
-                # wave_2에서 delivery 된 경우
-                if wid in wave_2_d:
-                    v2, a2 = wave_2_d[wid]
-
-                    # pickup 차량과 delivery 차량이 다른 경우
-                    if v1 != v2:
-                        # pickup 차량의 도착 위치와 delivery 차량의 출발 위치가 다르면 에러
-                        if a1 != a2:
-                            raise HTTPException(
-                                500,
-                                f'work {wid} down at {a1} by {v1}, but up at {a2} by {v2}',
-                            )
-
-                        # 1_2 에서 만나서 교환
-                        swap_1_2_dict[v1].down.append(wid)
-                        swap_1_2_dict[v2].up.append(wid)
-
-                # wave_3에서 delivery 된 경우
-                elif wid in wave_3_d:
-                    v3, a3 = wave_3_d[wid]
+            route_data_tasks.append((v.profile.value, wave_3_dict[vs.id].tasks))
 
-                    # pickup 차량과 delivery 차량이 다른 경우
-                    if v1 != v3:
-                        vs1_2 = self.waves.w2.vehicles_dict[v1]
-                        vs3_2 = self.waves.w2.vehicles_dict[v3]
+        await self.setup_route_data(route_data_tasks)
 
-                        # pickup 차량이 wave_1에 도착한 집결지와
-                        # delivery 차량이 wave_2에 출발한 집결지가 같으면
-                        # 1_2 에서 만나서 교환
-                        if a1 == vs3_2.from_assembly_id:
-                            swap_1_2_dict[v1].down.append(wid)
-                            swap_1_2_dict[v3].up.append(wid)
-                        # pickup 차량이 wave_2에 도착한 집결지와
-                        # delivery 차량이 wave_3에 출발한 집결지가 같으면
-                        # 2_3 에서 만나서 교환
-                        elif vs1_2.to_assembly_id == a3:
-                            swap_2_3_dict[v1].down.append(wid)
-                            swap_2_3_dict[v3].up.append(wid)
-                        # 만나는 집결지가 존재하지 않음
-                        else:
-                            raise HTTPException(
-                                500,
-                                f'work {wid} cannot match at ' +
-                                f'1_2 (down at {a1} by {v1}, up at {vs3_2.from_assembly_id} by {v3}) and ' +
-                                f'2_3 (down at {vs1_2.to_assembly_id} by {v1}, up at {a3} by {v3})',
-                            )
-
-            # wave_2에서 pickup 된 주문
-            elif wid in wave_2_p:
-                v2, a2 = wave_2_p[wid]
-
-                # wave_2에서 delivery 된 경우
-                # 동일 차량으로 처리되므로 not considered in swap
-
-                # wave_3에서 delivery 된 경우
-                if wid in wave_3_d:
-                    v3, a3 = wave_3_d[wid]
-
-                    # pickup 차량과 delivery 차량이 다른 경우
-                    if v2 != v3:
-                        # pickup 차량의 도착 위치와 delivery 차량의 출발 위치가 다르면 에러
-                        if a2 != a3:
-                            raise HTTPException(
-                                500,
-                                f'work {wid} down at {a2} by {v2}, but up at {a3} by {v3}',
-                            )
-
-                        # 2_3 에서 만나서 교환
-                        swap_2_3_dict[v2].down.append(wid)
-                        swap_2_3_dict[v3].up.append(wid)
+        swap_planner.plan(self.work_dict.keys(), swap_1_2_dict, swap_2_3_dict)
 
         wave_1: list[VehicleTasks] = [ v for _, v in wave_1_dict.items() ]
         swap_1_2: list[VehicleSwaps] = [ v for _, v in swap_1_2_dict.items() ]
@@ -1755,4 +2163,5 @@ class OptimizationHandler:
             wave_2=wave_2,
             swap_2_3=swap_2_3,
             wave_3=wave_3,
+            unmatched=swap_planner.unmatched if len(swap_planner.unmatched) > 0 else None,
         )
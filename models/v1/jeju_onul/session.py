@@ -0,0 +1,181 @@
+from fastapi import HTTPException
+
+import asyncio
+import os
+import uuid
+
+from dependencies.cache import LRUCache
+from dependencies.results import TrimMemo
+
+from .internal import OptimizationHandler, StagePlan
+from .transaction import *
+
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '256'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', '86400'))
+
+class Session:
+    """
+    마지막 계획을 반영한 request, 최적화 결과, 단계별 계획과 vroouty 응답(memo)을 보관하여
+    변경분(`Deltas`)만 받아 영향을 받는 차량만 다시 계산한다.
+    """
+
+    id: str
+    lock: asyncio.Lock
+
+    request: Request
+    response: Response | None
+    memo: dict[str, bytes]
+    plans: dict[tuple, StagePlan]
+
+    def __init__(self, request: Request) -> None:
+        self.id = uuid.uuid4().hex
+        self.lock = asyncio.Lock()
+
+        # OptimizationHandler가 work status를 변경하므로 복사본을 보관
+        self.request = request.model_copy(deep=True)
+        self.response = None
+        self.memo = {}
+        self.plans = {}
+
+    def accept(self, request: Request, response: Response, opt: OptimizationHandler):
+        """
+        `response`를 채택하여 `request`의 schedules에 반영하고 보관한다.
+
+        차량별 tasks는 완료된 task 뒤에 계획된 task를 이어 붙이고, `up`, `down`은 swap 결과로 바꾼다.
+        계획된 task의 완료 여부는 `work_status` 변경분으로만 바뀐다.
+        """
+        schedules = request.schedules
+
+        for schedule, vehicle_tasks in [
+                (schedules.wave_1, response.wave_1),
+                (schedules.wave_2, response.wave_2),
+                (schedules.wave_3, response.wave_3),
+            ]:
+            planned = { vt.vehicle_id: vt.tasks for vt in vehicle_tasks }
+
+            for vs in schedule.vehicles:
+                done = [ t for t in vs.tasks if t.done ]
+                handled = { (t.type, t.work_id) for t in done }
+
+                vs.tasks = done + [
+                    t.model_copy(update={ 'done': False }) for t in planned.get(vs.id, []) if (t.type, t.work_id) not in handled
+                ]
+
+        for schedule, swaps, attribute in [
+                (schedules.wave_1, response.swap_1_2, 'down'),
+                (schedules.wave_2, response.swap_1_2, 'up'),
+                (schedules.wave_2, response.swap_2_3, 'down'),
+                (schedules.wave_3, response.swap_2_3, 'up'),
+            ]:
+            works = { s.vehicle_id: getattr(s, attribute) for s in swaps }
+
+            for vs in schedule.vehicles:
+                setattr(vs, attribute, list(works.get(vs.id, [])))
+
+        self.request = request
+        self.response = response
+        self.memo = TrimMemo(opt.memo)
+        self.plans = opt.plans
+
+    def apply(self, deltas: Deltas) -> Request:
+        """
+        보관중인 request에 `deltas`를 적용한 새 request
+        """
+        request = self.request.model_copy(deep=True)
+
+        request.current_time = deltas.current_time
+        if deltas.current_status is not None:
+            request.current_status = deltas.current_status
+
+        works = { w.id: w for w in request.works }
+        vehicles = { v.id: v for v in request.vehicles }
+
+        for i, delta in enumerate(deltas.deltas):
+
+            if delta.type == DeltaType.add_work:
+                if delta.work is None:
+                    raise HTTPException(422, f'deltas[{i}]: work is required')
+                if delta.work.id in works:
+                    raise HTTPException(409, f'deltas[{i}]: work {delta.work.id} already exists')
+
+                works[delta.work.id] = delta.work
+
+            elif delta.type == DeltaType.cancel_work:
+                if delta.work_id not in works:
+                    raise HTTPException(404, f'deltas[{i}]: work {delta.work_id} not found')
+
+                del works[delta.work_id]
+                self.__remove_work_from_schedules(request, delta.work_id)
+
+            elif delta.type == DeltaType.work_status:
+                if delta.status is None:
+                    raise HTTPException(422, f'deltas[{i}]: status is required')
+                if delta.work_id not in works:
+                    raise HTTPException(404, f'deltas[{i}]: work {delta.work_id} not found')
+
+                works[delta.work_id].status = delta.status
+                self.__mark_done(request, delta.work_id, delta.status)
+
+            elif delta.type == DeltaType.move_vehicle:
+                if delta.location is None:
+                    raise HTTPException(422, f'deltas[{i}]: location is required')
+                if delta.vehicle_id not in vehicles:
+                    raise HTTPException(404, f'deltas[{i}]: vehicle {delta.vehicle_id} not found')
+
+                vehicles[delta.vehicle_id].location = delta.location
+
+        request.works = list(works.values())
+
+        return request
+
+    def __mark_done(self, request: Request, work_id: int, status: WorkStatus):
+        # 진행중인 wave에서 주문의 상태에 따라 처리된 task를 완료로 표시
+        if request.current_status == CurrentStatus.wave_1:
+            schedule = request.schedules.wave_1
+        elif request.current_status == CurrentStatus.wave_2:
+            schedule = request.schedules.wave_2
+        else:
+            return
+
+        types = set()
+        if status.type in [WorkStatusType.shipped, WorkStatusType.handle_delivery, WorkStatusType.assembly, WorkStatusType.done]:
+            types.add(TaskType.pickup)
+        if status.type == WorkStatusType.done:
+            types.add(TaskType.delivery)
+
+        for vs in schedule.vehicles:
+            if status.vehicle_id is not None and vs.id != status.vehicle_id:
+                continue
+
+            marked = False
+            for t in vs.tasks:
+                if t.work_id == work_id and t.type in types:
+                    t.done = True
+                    marked = True
+
+            # 주문을 처리한 차량은 이미 출발했다
+            if marked:
+                for t in vs.tasks:
+                    if t.type == TaskType.departure:
+                        t.done = True
+
+    def __remove_work_from_schedules(self, request: Request, work_id: int):
+        for schedule in [request.schedules.wave_1, request.schedules.wave_2, request.schedules.wave_3]:
+            for vs in schedule.vehicles:
+                vs.tasks = [ t for t in vs.tasks if t.work_id != work_id ]
+
+                if vs.up is not None:
+                    vs.up = [ u for u in vs.up if u != work_id ]
+                if vs.down is not None:
+                    vs.down = [ d for d in vs.down if d != work_id ]
+
+# session id: Session
+sessions = LRUCache('v1_sessions', maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL)
+
+def GetSession(session_id: str) -> Session:
+    session = sessions.get(session_id)
+
+    if session is None:
+        raise HTTPException(404, f'session {session_id} not found')
+
+    return session
@@ -271,6 +271,14 @@ class VehicleSwaps(BaseModel):
         description='Assembly에서 차량이 실어야 할 주문의 work_id list'
     )
 
+class UnmatchedWork(BaseModel):
+    work_id: NonNegativeInt
+    pickup_vehicle_id: NonNegativeInt
+    delivery_vehicle_id: NonNegativeInt
+    detail: str = Field(
+        description='교환할 집결지를 찾지 못한 이유',
+    )
+
 class Response(BaseModel):
     v: str = Field(default=env.VERSION)
     wave_1: list[VehicleTasks]
@@ -278,3 +286,59 @@ class Response(BaseModel):
     wave_2: list[VehicleTasks]
     swap_2_3: list[VehicleSwaps]
     wave_3: list[VehicleTasks]
+    unmatched: list[UnmatchedWork] | None = Field(
+        default=None,
+        description='pickup 차량과 delivery 차량이 만나는 집결지가 없어 `swap_1_2`, `swap_2_3`에 포함되지 못한 주문',
+    )
+
+class DeltaType(Enum):
+    add_work = 'add_work'
+    cancel_work = 'cancel_work'
+    work_status = 'work_status'
+    move_vehicle = 'move_vehicle'
+
+class Delta(BaseModel):
+    type: DeltaType = Field(
+        description='''변경 종류\n
+`add_work`: `work` 추가\n
+`cancel_work`: `work_id` 주문 취소\n
+`work_status`: `work_id` 주문의 상태를 `status`로 변경\n
+`move_vehicle`: `vehicle_id` 차량의 현재위치를 `location`으로 변경
+''',
+    )
+    work: Work | None = Field(
+        default=None,
+        description='for `add_work`',
+    )
+    work_id: NonNegativeInt | None = Field(
+        default=None,
+        description='for `cancel_work`, `work_status`',
+    )
+    status: WorkStatus | None = Field(
+        default=None,
+        description='for `work_status`',
+    )
+    vehicle_id: NonNegativeInt | None = Field(
+        default=None,
+        description='for `move_vehicle`',
+    )
+    location: Coordinate | None = Field(
+        default=None,
+        description='for `move_vehicle`',
+    )
+
+class Deltas(BaseModel):
+    current_time: NonNegativeInt = Field(
+        description='현재 시간 (in unixtimestamp millis)'
+    )
+    current_status: CurrentStatus | None = Field(
+        default=None,
+        description='변경된 경우에만 입력',
+    )
+    deltas: list[Delta] = Field(
+        default=[],
+    )
+
+class SessionResponse(BaseModel):
+    session_id: str
+    response: Response
@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+
+from enum import Enum
+
+class AfterWaveAlgorithmType(Enum):
+    sequential = 'sequential'
+    pipelined = 'pipelined'
+
+class AfterWaveAlgorithm(BaseModel):
+    type: AfterWaveAlgorithmType = Field(
+        default=AfterWaveAlgorithmType.sequential,
+        description='''`/jeju_onul_after`의 wave 2, wave 3 계산 방법\n
+`sequential`: wave 2 재배차가 끝난 뒤 wave 3 계산\n
+`pipelined`: wave 2 계획에서 delivery되는 work를 완료로 가정하고 wave 3을 미리 계산, 재배차 결과 완료된 delivery가 달라진 경우에만 다시 계산
+''',
+    )
+
+class Algorithm(BaseModel):
+    after_wave: AfterWaveAlgorithm = Field(
+        default=AfterWaveAlgorithm(),
+    )
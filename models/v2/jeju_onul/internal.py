@@ -1,14 +1,22 @@
 from fastapi import HTTPException
 from http import HTTPStatus
+import asyncio
 import concurrent.futures
-import json
+import contextlib
 
+from .algorithm import *
 from .transaction import *
-from datetime import timedelta
+import dependencies.concurrency as concurrency
 import dependencies.vroouty as vroouty
 import dependencies.osrm as osrm
+from dependencies.cache import LRUCache
+from dependencies.log import GetLogger
+import shapely
 import shapely.geometry as geometry
 from collections import defaultdict
+from typing import Awaitable
+
+logger = GetLogger('v2.internal')
 
 PRIORITY_MUST_HAVE_TO = 99
 PRIORITY_HIGHEST = 40
@@ -17,6 +25,83 @@ PRIORITY_MEDIUM = 20
 PRIORITY_LOW = 10
 PRIORITY_LOWEST = 0
 
+class BoundaryIndex:
+    """
+    boundary polygon들의 STRtree, 여러 위치가 속한 boundary를 한 번에 찾는다.
+
+    위치가 여러 boundary에 속하면 request에서 앞선 boundary를 선택한다.
+    """
+
+    def __init__(self, boundaries: list[Boundary]) -> None:
+        polygon_dict = {b.id: geometry.Polygon(b.polygon) for b in boundaries}
+
+        self.ids: list[str] = list(polygon_dict.keys())
+        self.tree = shapely.STRtree(list(polygon_dict.values()))
+
+    def group_ids(self, locations: list[Coordinates]) -> list[str | None]:
+        if len(locations) == 0 or len(self.ids) == 0:
+            return [None] * len(locations)
+
+        point_indexes, polygon_indexes = self.tree.query(shapely.points(locations), predicate='within')
+
+        matches: list[int | None] = [None] * len(locations)
+        for p, g in zip(point_indexes.tolist(), polygon_indexes.tolist()):
+            if matches[p] is None or g < matches[p]:
+                matches[p] = g
+
+        return [self.ids[g] if g is not None else None for g in matches]
+
+# boundary 목록은 거의 바뀌지 않으므로 request 간에 index를 재사용
+boundary_indexes = LRUCache('v2_boundaries', maxsize=16)
+
+def GetBoundaryIndex(boundaries: list[Boundary]) -> BoundaryIndex:
+    key = tuple((b.id, tuple(b.polygon)) for b in boundaries)
+
+    index = boundary_indexes.get(key)
+    if index is None:
+        index = BoundaryIndex(boundaries)
+        boundary_indexes.set(key, index)
+
+    return index
+
+# 같은 위치로 보는 좌표 차이 (약 0.1m), engine을 거치며 생기는 float 오차를 허용
+LOCATION_TOLERANCE = 1e-6
+
+class LocationIndex:
+    """
+    좌표를 `tolerance` 크기의 격자로 나눈 index, 위치가 `tolerance` 이내인 id들을 추가한 순서대로 찾는다.
+
+    격자 경계에 걸친 좌표도 찾을 수 있도록 인접한 격자까지 확인한다.
+    """
+
+    tolerance: float
+    __cells: dict[tuple[int, int], list[tuple[int, Coordinates, str]]]
+    __count: int
+
+    def __init__(self, tolerance: float = LOCATION_TOLERANCE) -> None:
+        self.tolerance = tolerance
+        self.__cells = defaultdict(list)
+        self.__count = 0
+
+    def __cell(self, location: Coordinates) -> tuple[int, int]:
+        return round(location[0] / self.tolerance), round(location[1] / self.tolerance)
+
+    def add(self, location: Coordinates, id: str) -> None:
+        self.__cells[self.__cell(location)].append((self.__count, location, id))
+        self.__count += 1
+
+    def find(self, location: Coordinates) -> list[str]:
+        x, y = self.__cell(location)
+
+        found = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for order, l, id in self.__cells.get((x + dx, y + dy), []):
+                    if abs(l[0] - location[0]) <= self.tolerance and abs(l[1] - location[1]) <= self.tolerance:
+                        found.append((order, id))
+
+        return [ id for _, id in sorted(found) ]
+
 class Skills:
     __unique_skill_id: int
     __skills: dict[str, int]
@@ -102,59 +187,62 @@ class OptimizationHandler:
     def __init__(self, request: Request) -> None:
         self.vehicle_dict: dict[str, Vehicle]
         self.assembly_dict: dict[str, Assembly]
+        self.assembly_index: LocationIndex
         self.work_dict: dict[str, Work]
         self.skills: Skills
+        self.memo: dict[str, bytes]
 
+        self.algorithm = request.algorithm
         self.vehicle_dict = {v.id: v for v in request.vehicles}
         self.assembly_dict = {a.id: a for a in request.assemblies}
+        self.assembly_index = LocationIndex()
+        for a in request.assemblies:
+            self.assembly_index.add(a.location, a.id)
         self.work_dict = {w.id: w for w in request.works}
-        self.polygon_dict = {p.id: geometry.Polygon(p.polygon) for p in request.boundaries}
         self.skills = Skills(request.vehicles, request.assemblies)
         self.id_handler = IdHandler()
+        self.memo = {}
 
         pickup_location_count = defaultdict(int)
         delivery_location_count = defaultdict(int)
 
-        for _, work in self.work_dict.items():
-            for group, polygon in self.polygon_dict.items():
-                if polygon.contains(geometry.Point(work.pickup.location)):
-                    work.pickup.group_id = group
-                    break
+        works = list(self.work_dict.values())
+
+        boundary_index = GetBoundaryIndex(request.boundaries)
+        pickup_groups = boundary_index.group_ids([w.pickup.location for w in works])
+        delivery_groups = boundary_index.group_ids([w.delivery.location for w in works])
+
+        for work, pickup_group, delivery_group in zip(works, pickup_groups, delivery_groups):
+            if pickup_group is not None:
+                work.pickup.group_id = pickup_group
 
-            for group, polygon in self.polygon_dict.items():
-                if polygon.contains(geometry.Point(work.delivery.location)):
-                    work.delivery.group_id = group
-                    break
+            if delivery_group is not None:
+                work.delivery.group_id = delivery_group
 
             pickup_location_count[tuple(work.pickup.location)] += 1
             delivery_location_count[tuple(work.delivery.location)] += 1
 
-        pickup_duplicated_locations = [location for location, count in pickup_location_count.items() if count >= 2]
-        delivery_duplicated_locations = [location for location, count in delivery_location_count.items() if count >= 2]
+        rule = request.work_time
 
-        for _, work in self.work_dict.items():
-            if tuple(work.pickup.location) in pickup_duplicated_locations: 
-                work.pickup.setup_time=timedelta(seconds=300)
-                work.pickup.service_time=timedelta(seconds=10)
-                self.work_dict[work.id] = work
+        pickup_duplicated_locations = {location for location, count in pickup_location_count.items() if count >= rule.duplicated_threshold}
+        delivery_duplicated_locations = {location for location, count in delivery_location_count.items() if count >= rule.duplicated_threshold}
+
+        for work in works:
+            if tuple(work.pickup.location) in pickup_duplicated_locations:
+                work.pickup.setup_time = rule.duplicated_setup_time
             else:
-                work.pickup.setup_time=timedelta(seconds=180)
-                work.pickup.service_time=timedelta(seconds=10)
-                self.work_dict[work.id] = work
+                work.pickup.setup_time = rule.setup_time
+            work.pickup.service_time = rule.service_time
 
             if tuple(work.delivery.location) in delivery_duplicated_locations:
-                work.delivery.setup_time=timedelta(seconds=300)
-                work.delivery.service_time=timedelta(seconds=10)
-                self.work_dict[work.id] = work
+                work.delivery.setup_time = rule.duplicated_setup_time
             else:
-                work.delivery.setup_time=timedelta(seconds=180)
-                work.delivery.service_time=timedelta(seconds=10)
-                self.work_dict[work.id] = work
+                work.delivery.setup_time = rule.setup_time
+            work.delivery.service_time = rule.service_time
 
     async def process_opt_wave1(self):
         vehicle_groups = dict()
         vehicle_works: dict[str, list[Work]] = dict()
-        vty_responses = dict()
 
 
         for vehicle_id, vehicle in self.vehicle_dict.items():
@@ -176,6 +264,8 @@ class OptimizationHandler:
             handling_vehicle_id = vehicle_groups[work.pickup.group_id]
             vehicle_works[handling_vehicle_id].append(work)
 
+        solves: dict[str, Awaitable[dict]] = {}
+
         for _, vehicle in self.vehicle_dict.items():
             vty_jobs = []
             vty_shipments = []
@@ -209,51 +299,83 @@ class OptimizationHandler:
                 }
             }
 
-            status, vty_response = await vroouty.Post(vroouty_request)
-
-            # 각 차량 배차결과가 30분 이내에 완료될시 부권역과 delivery job 추가 후 재배차
-            if 1800 > int(
-                    next(step["arrival"] for step in vty_response["routes"][0]["steps"] if step["type"] == "end")):
-                vty_jobs = []
-
-                for work in vehicle_works[vehicle.id]:
-                    if work.status.type == WorkStatusType.waiting and work.pickup.group_id in vehicle.exclude:
-                        vty_jobs.append(work.pickup.to_job(index=self.id_handler.pickup_index(work.id)))
-                    elif work.status.type == WorkStatusType.waiting:
-                        if work.pickup.group_id in vehicle.include and work.delivery.group_id in vehicle.include:
-                            pickup_job = work.pickup.to_job(index=self.id_handler.pickup_index(work.id))
-                            delivery_job = work.delivery.to_job(index=self.id_handler.delivery_index(work.id))
-                            vty_shipments.append(
-                                {
-                                    'pickup': pickup_job,
-                                    'delivery': delivery_job
-                                }
-                            )
-                            continue
+            # 30분 이내에 완료될 경우의 재배차 request
+            # (index가 요청 완료 순서에 따라 달라지지 않도록 미리 만들어둔다)
+            extended_jobs = []
+            extended_shipments = []
 
+            for work in vehicle_works[vehicle.id]:
+                if work.status.type == WorkStatusType.waiting and work.pickup.group_id in vehicle.exclude:
+                    extended_jobs.append(work.pickup.to_job(index=self.id_handler.pickup_index(work.id)))
+                elif work.status.type == WorkStatusType.waiting:
+                    if work.pickup.group_id in vehicle.include and work.delivery.group_id in vehicle.include:
                         pickup_job = work.pickup.to_job(index=self.id_handler.pickup_index(work.id))
-                        vty_jobs.append(pickup_job)
-                    elif work.status.type == WorkStatusType.shipped and work.delivery.group_id in vehicle.include:
-                        vty_jobs.append(work.delivery.to_job(index=self.id_handler.delivery_index(work.id)))
+                        delivery_job = work.delivery.to_job(index=self.id_handler.delivery_index(work.id))
+                        extended_shipments.append(
+                            {
+                                'pickup': pickup_job,
+                                'delivery': delivery_job
+                            }
+                        )
+                        continue
 
-                vroouty_request = {
-                    'jobs': vty_jobs,
-                    'shipments': vty_shipments,
-                    'vehicles': vty_vehicles,
-                    'distribute_options': {
-                        'custom_matrix': {
-                            'enabled': True
-                        }
+                    pickup_job = work.pickup.to_job(index=self.id_handler.pickup_index(work.id))
+                    extended_jobs.append(pickup_job)
+                elif work.status.type == WorkStatusType.shipped and work.delivery.group_id in vehicle.include:
+                    extended_jobs.append(work.delivery.to_job(index=self.id_handler.delivery_index(work.id)))
+
+            extended_request = {
+                'jobs': extended_jobs,
+                'shipments': extended_shipments,
+                'vehicles': vty_vehicles,
+                'distribute_options': {
+                    'custom_matrix': {
+                        'enabled': True
                     }
                 }
-                status, vty_response = await vroouty.Post(vroouty_request)
+            }
 
-            if status != 200:
-                raise HTTPException(500, vty_response)
+            solves[vehicle.id] = self.solve_wave1_vehicle(vroouty_request, extended_request)
 
-            vty_responses[vehicle.id] = vty_response
+        return await self.solve_vehicles(solves)
+
+    async def solve_wave1_vehicle(self, vroouty_request: dict, extended_request: dict) -> dict:
+        vty_response = await self.solve(vroouty_request)
+
+        # 각 차량 배차결과가 30분 이내에 완료될시 부권역과 delivery job 추가 후 재배차
+        if 1800 > int(
+                next(step["arrival"] for step in vty_response["routes"][0]["steps"] if step["type"] == "end")):
+            vty_response = await self.solve(extended_request)
+
+        return vty_response
 
-        return vty_responses
+    async def solve(self, vroouty_request: dict) -> dict:
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
+
+        if status != 200:
+            raise HTTPException(500, vty_response)
+
+        return vty_response
+
+    async def solve_vehicles(self, solves: dict[str, Awaitable[dict]]) -> dict[str, dict]:
+        """
+        차량별 계산을 동시에 실행하고 `solves`의 차량 순서대로 결과를 반환한다.
+
+        실패한 차량이 있으면 차량별 오류를 모아 500으로 응답한다.
+        """
+        results = await concurrency.gather(solves.values(), limit=vroouty.MAX_CONCURRENCY, return_exceptions=True)
+
+        errors = {}
+        for vehicle_id, result in zip(solves.keys(), results):
+            if isinstance(result, HTTPException):
+                errors[vehicle_id] = result.detail
+            elif isinstance(result, BaseException):
+                errors[vehicle_id] = repr(result)
+
+        if len(errors) > 0:
+            raise HTTPException(500, errors)
+
+        return dict(zip(solves.keys(), results))
 
     async def process_opt_wave2(self):
         vty_jobs = []
@@ -288,23 +410,23 @@ class OptimizationHandler:
             }
         }
 
-        status, vty_response = await vroouty.Post(vroouty_request)
-
-        # import json
-        # print(json.dumps(vty_response))
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
 
         if status != 200:
             raise HTTPException(500, vty_response)
 
         return vty_response
 
-    async def process_opt_wave3(self):
+    def done_work_ids(self) -> set[str]:
+        return {work_id for work_id, work in self.work_dict.items() if work.status.type == WorkStatusType.done}
+
+    def make_wave3_request(self, done_work_ids: set[str]) -> dict:
         vty_jobs = []
         vty_shipments = []
         vty_vehicles = []
 
         for _, work in self.work_dict.items():
-            if work.status.type == WorkStatusType.done:
+            if work.id in done_work_ids:
                 continue
             delivery_job = work.delivery.to_job(index=self.id_handler.delivery_index(work.id))
             vty_jobs.append(delivery_job)
@@ -316,7 +438,7 @@ class OptimizationHandler:
                 'start': next(iter(self.assembly_dict.values())).location
             })
 
-        vroouty_request = {
+        return {
             'jobs': vty_jobs,
             'shipments': vty_shipments,
             'vehicles': vty_vehicles,
@@ -329,12 +451,59 @@ class OptimizationHandler:
                 }
             }
         }
-        status, vty_response = await vroouty.Post(vroouty_request)
 
-        if status != 200:
-            raise HTTPException(500, vty_response)
-        
-        return vty_response
+    async def process_opt_wave3(self):
+        return await self.solve(self.make_wave3_request(self.done_work_ids()))
+
+    async def process_opt_afterwave(self) -> tuple[list[VehicleTasks], dict]:
+        """
+        wave 2 재배차 결과(before tasks)와 wave 3 계산 결과를 반환한다.
+        """
+        wave2_response = await self.process_opt_wave2()
+
+        if self.algorithm.after_wave.type == AfterWaveAlgorithmType.sequential:
+            before_tasks = await self.make_beforetask(wave2_response)
+            return before_tasks, await self.process_opt_wave3()
+
+        # wave 3은 완료된 delivery에만 의존하므로 wave 2 계획대로 완료된다고 가정하고 먼저 계산
+        # (집결 시각보다 먼저 도착하는 차량은 재배차에서 shipped work를 모두 delivery한다고 가정)
+        expected_done = self.done_work_ids()
+        assemble_time = max([vehicle['steps'][-1]['arrival'] for vehicle in wave2_response['routes']], default=0)
+
+        for vehicle in wave2_response['routes']:
+            for step in vehicle['steps']:
+                if step['type'] in ['job', 'delivery']:
+                    index_type, work_id = self.id_handler.get_id(step['id'])
+                    if index_type in ['delivery', 'shipment_delivery']:
+                        expected_done.add(work_id)
+
+            if vehicle['steps'][-1]['arrival'] < assemble_time:
+                _, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
+                for work_id, work in self.work_dict.items():
+                    if work.status.type == WorkStatusType.shipped and work.status.vehicle_id == vehicle_id:
+                        expected_done.add(work_id)
+
+        wave3 = asyncio.ensure_future(self.solve(self.make_wave3_request(expected_done)))
+
+        try:
+            before_tasks = await self.make_beforetask(wave2_response)
+        except BaseException:
+            await self.discard(wave3)
+            raise
+
+        if self.done_work_ids() == expected_done:
+            return before_tasks, await wave3
+
+        logger.info('wave 3 speculation missed: %s', expected_done ^ self.done_work_ids())
+        await self.discard(wave3)
+
+        return before_tasks, await self.process_opt_wave3()
+
+    async def discard(self, task: asyncio.Future):
+        # 이미 실패한 task는 cancel되지 않으므로 결과를 회수하여 "Task exception was never retrieved"를 막는다
+        task.cancel()
+        with contextlib.suppress(BaseException):
+            await task
 
     async def make_beforetask(self, vty_response: dict):
         vehicle_tasks: list[VehicleTasks] = []
@@ -343,6 +512,9 @@ class OptimizationHandler:
         for vehicle in vty_response['routes']:
             vehicles_assemble_time.append(vehicle['steps'][-1]['arrival'])
 
+        # 집결 시각보다 먼저 도착하는 차량은 집결 시각까지 다시 배차 (차량별로 독립이므로 동시에 계산)
+        solves: dict[str, Awaitable[dict]] = {}
+
         for vehicle in vty_response['routes']:
             step_list = []
             for step in vehicle['steps']:
@@ -383,128 +555,93 @@ class OptimizationHandler:
                         }
                     }
                 }
-                status, response_modified = await vroouty.Post(vroouty_request)
-
-                for vehicle_modified in response_modified['routes']:
-                    tasks: list[Task] = []
-                    for step in vehicle_modified['steps']:
-                        eta = step['arrival']
-                        duration = step['duration']
-                        distance = step['distance']
-                        setup_time = step['setup']
-                        service_time = step['service']
-                        location = (step['location'][0], step['location'][1])
-
-                        if step['type'] in ['job', 'pickup', 'delivery']:
-                            index_type, work_id = self.id_handler.get_id(step['id'])
-
-                            if index_type in ['pickup', 'shipment_pickup']:
-                                tasks.append(Task(
-                                    work_id=work_id,
-                                    type=TaskType.pickup,
-                                    eta=eta,
-                                    duration=duration,
-                                    distance=distance,
-                                    setup_time=setup_time,
-                                    service_time=service_time,
-                                    assembly_id=None,
-                                    location=location,
-                                ))
-
-                            elif index_type in ['delivery', 'shipment_delivery']:
-                                tasks.append(Task(
-                                    work_id=work_id,
-                                    type=TaskType.delivery,
-                                    eta=eta,
-                                    duration=duration,
-                                    distance=distance,
-                                    setup_time=setup_time,
-                                    service_time=service_time,
-                                    location=location,
-                                ))
-                        elif step['type'] in ['end']:
-                            tasks.append(Task(
-                                work_id=None,
-                                type=TaskType.arrival,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=next(iter(self.assembly_dict.values())).id,
-                                location=location,
-                            ))
-
-                    _, vehicle_id = self.id_handler.get_id(vehicle_modified['vehicle'])
-                    vehicle_tasks.append(VehicleTasks(
-                        vehicle_id=vehicle_id,
-                        tasks=tasks,
-                    ))
-            else :
-                tasks: list[Task] = []
-                for step in vehicle['steps']:
-                    eta = step['arrival']
-                    duration = step['duration']
-                    distance = step['distance']
-                    setup_time = step['setup']
-                    service_time = step['service']
-                    location = (step['location'][0], step['location'][1])
-
-                    if step['type'] in ['job', 'pickup', 'delivery']:
-                        index_type, work_id = self.id_handler.get_id(step['id'])
-
-                        if index_type in ['pickup', 'shipment_pickup']:
-                            tasks.append(Task(
-                                work_id=work_id,
-                                type=TaskType.pickup,
-                                eta=eta,
-                                duration=duration,
-                                distance=distance,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=None,
-                                location=location,
-                            ))
-
-                        elif index_type in ['delivery', 'shipment_delivery']:
-                            tasks.append(Task(
-                                work_id=work_id,
-                                type=TaskType.delivery,
-                                eta=eta,
-                                duration=duration,
-                                distance=distance,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                location=location,
-                            ))
-                    elif step['type'] in ['end']:
-                        tasks.append(Task(
-                            work_id=None,
-                            type=TaskType.arrival,
-                            eta=eta,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=next(iter(self.assembly_dict.values())).id,
-                            location=location,
-                        ))
+                solves[self.id_handler.get_id(vehicle['vehicle'])[1]] = self.solve(vroouty_request)
 
-                _, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
-                vehicle_tasks.append(VehicleTasks(
-                    vehicle_id=vehicle_id,
-                    tasks=tasks,
-                ))
+        responses_modified = await self.solve_vehicles(solves)
+
+        for vehicle in vty_response['routes']:
+            _, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
+
+            if vehicle_id in responses_modified:
+                for vehicle_modified in responses_modified[vehicle_id]['routes']:
+                    vehicle_tasks.append(self.make_beforetask_vehicle(vehicle_modified))
+            else :
+                vehicle_tasks.append(self.make_beforetask_vehicle(vehicle))
 
         await self.beforetask_delivery_done(vehicle_tasks) 
         return vehicle_tasks
 
+    def make_tasks(self, route: dict, arrival: bool = True, assembly_id: str | None = None) -> list[Task]:
+        """
+        vroouty route의 step들을 순서대로 task로 변환한다.
+
+        engine 결과는 검증할 필요가 없으므로 `model_construct`로 생성하되 정수 field는 `int`로 변환하고,
+        `arrival=True`이면 end step을 `assembly_id`(없으면 같은 위치의 집결지)에 도착하는 task로 추가한다.
+        """
+        tasks: list[Task] = []
+
+        for step in route['steps']:
+            step_type = step['type']
+
+            if step_type in ('job', 'pickup', 'delivery'):
+                index_type, work_id = self.id_handler.get_id(step['id'])
+
+                if index_type in ('pickup', 'shipment_pickup'):
+                    task_type = TaskType.pickup
+                elif index_type in ('delivery', 'shipment_delivery'):
+                    task_type = TaskType.delivery
+                else:
+                    continue
+
+                tasks.append(Task.model_construct(
+                    work_id=work_id,
+                    type=task_type,
+                    eta=int(step['arrival']),
+                    duration=int(step['duration']),
+                    distance=int(step['distance']),
+                    setup_time=int(step['setup']),
+                    service_time=int(step['service']),
+                    assembly_id=None,
+                    location=Coordinates(*step['location']),
+                ))
+
+            elif step_type == 'end' and arrival:
+                location = Coordinates(*step['location'])
+                assembly_ids = [assembly_id] if assembly_id is not None else self.assembly_ids_at(location)
+
+                for arrival_assembly_id in assembly_ids:
+                    tasks.append(Task.model_construct(
+                        work_id=None,
+                        type=TaskType.arrival,
+                        eta=int(step['arrival']),
+                        setup_time=int(step['setup']),
+                        service_time=int(step['service']),
+                        assembly_id=arrival_assembly_id,
+                        location=location,
+                    ))
+
+        return tasks
+
+    def assembly_ids_at(self, location: Coordinates) -> list[str]:
+        return self.assembly_index.find(location)
+
+    def make_beforetask_vehicle(self, vehicle: dict) -> VehicleTasks:
+        _, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
+        return VehicleTasks.model_construct(
+            vehicle_id=vehicle_id,
+            tasks=self.make_tasks(vehicle, assembly_id=next(iter(self.assembly_dict.values())).id),
+        )
+
     async def beforetask_delivery_done(self, vehicles_tasks):
         #집결전 task에서 delivery된 work status done 처리
-        done_worklist = []
+        done_work_ids = set()
         for vehicle_tasks in vehicles_tasks:
             for task in vehicle_tasks.tasks:
                 if task.type == TaskType.delivery:
-                    done_worklist.append(task.work_id)
-        
+                    done_work_ids.add(task.work_id)
+
         for work_id,work in self.work_dict.items():
-            if work_id in done_worklist:
+            if work_id in done_work_ids:
                 work.status.type = WorkStatusType.done
 
 
@@ -512,47 +649,10 @@ class OptimizationHandler:
         vehicle_tasks: list[VehicleTasks] = []
 
         for vehicle in vty_response['routes']:
-            tasks: list[Task] = []
-            for step in vehicle['steps']:
-                eta = step['arrival']
-                duration = step['duration']
-                distance = step['distance']
-                setup_time = step['setup']
-                service_time = step['service']
-                location = (step['location'][0], step['location'][1])
-
-                if step['type'] in ['job', 'pickup', 'delivery']:
-                    index_type, work_id = self.id_handler.get_id(step['id'])
-
-                    if index_type in ['pickup', 'shipment_pickup']:
-                        tasks.append(Task(
-                            work_id=work_id,
-                            type=TaskType.pickup,
-                            eta=eta,
-                            duration=duration,
-                            distance=distance,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=None,
-                            location=location,
-                        ))
-
-                    elif index_type in ['delivery', 'shipment_delivery']:
-                        tasks.append(Task(
-                            work_id=work_id,
-                            type=TaskType.delivery,
-                            eta=eta,
-                            duration=duration,
-                            distance=distance,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            location=location,
-                        ))
-
-            vehicle, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
-            vehicle_tasks.append(VehicleTasks(
+            _, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
+            vehicle_tasks.append(VehicleTasks.model_construct(
                 vehicle_id=vehicle_id,
-                tasks=tasks,
+                tasks=self.make_tasks(vehicle, arrival=False),
             ))
 
         return vehicle_tasks
@@ -573,59 +673,9 @@ class OptimizationHandler:
 
                 vehicle_index = self.id_handler.vehicle_index(vehicle_id)
                 if vehicle_index in routes_dict:
-                    routes = routes_dict[vehicle_index]
-
-                    for step in routes['steps']:
-                        eta = step['arrival']
-                        duration = step['duration']
-                        distance = step['distance']
-                        setup_time = step['setup']
-                        service_time = step['service']
-                        location = (step['location'][0], step['location'][1])
-
-                        if step['type'] in ['job', 'pickup', 'delivery']:
-                            index_type, work_id = self.id_handler.get_id(step['id'])
-                            if index_type in ['pickup', 'shipment_pickup']:
-
-                                tasks.append(Task(
-                                    work_id=work_id,
-                                    type=TaskType.pickup,
-                                    eta=eta,
-                                    duration=duration,
-                                    distance=distance,
-                                    setup_time=setup_time,
-                                    service_time=service_time,
-                                    assembly_id=None,
-                                    location=location,
-                                ))
-
-                            elif index_type in ['delivery', 'shipment_delivery']:
-                                tasks.append(Task(
-                                    work_id=work_id,
-                                    type=TaskType.delivery,
-                                    eta=eta,
-                                    duration=duration,
-                                    distance=distance,
-                                    setup_time=setup_time,
-                                    service_time=service_time,
-                                    assembly_id=None,
-                                    location=location,
-                                ))
-                        elif step['type'] in ['end']:
-                            for assembly_id, assembly in self.assembly_dict.items():
-                                if assembly.location == location:
-                                    tasks.append(Task(
-                                        work_id=None,
-                                        type=TaskType.arrival,
-                                        eta=eta,
-                                        setup_time=setup_time,
-                                        service_time=service_time,
-                                        assembly_id=assembly_id,
-                                        location=location,
-                                    ))
-
-
-            vehicle_tasks.append(VehicleTasks(
+                    tasks = self.make_tasks(routes_dict[vehicle_index])
+
+            vehicle_tasks.append(VehicleTasks.model_construct(
                 vehicle_id=vehicle_id,
                 tasks=tasks,
             ))
@@ -636,49 +686,48 @@ class OptimizationHandler:
         )
 
     def make_afterwave_response(self, before_tasks: list[VehicleTasks], after_tasks: list[VehicleTasks]):
-        swaps: list[VehicleSwaps] = []
+        # vehicle_id: 집결 시점에 싣고 있는 work id / 집결 이후 배송할 work id
+        shipped_tasks: dict[str, list[str]] = defaultdict(list)
+        need_tasks: dict[str, list[str]] = defaultdict(list)
         end_time = []
 
-        for vehicle_id, vehicle in self.vehicle_dict.items():
-            shipped_tasks = []
-            need_tasks = []
+        for vehicle_tasks in before_tasks:
+            if vehicle_tasks.vehicle_id not in self.vehicle_dict:
+                continue
+            for task in vehicle_tasks.tasks:
+                if task.work_id is not None: shipped_tasks[vehicle_tasks.vehicle_id].append(task.work_id)
+                if task.type == TaskType.arrival: end_time.append(task.eta)
 
-            for vehicle_tasks in before_tasks:
-                if vehicle_tasks.vehicle_id == vehicle_id:
-                    for task in vehicle_tasks.tasks:
-                        if task.work_id is not None: shipped_tasks.append(task.work_id)
-                        if task.type == TaskType.arrival: end_time.append(task.eta)
+        # wave2 이전에 shipped된 work추가
+        for _, work in self.work_dict.items():
+            if work.status.type == WorkStatusType.shipped:
+                shipped_tasks[work.status.vehicle_id].append(work.id)
+
+        for deliver_tasks in after_tasks:
+            for task in deliver_tasks.tasks:
+                if task.work_id is not None: need_tasks[deliver_tasks.vehicle_id].append(task.work_id)
 
-            # wave2 이전에 shipped된 work추가
-            for _, work in self.work_dict.items():
-                if work.status.type == WorkStatusType.shipped:
-                    if work.status.vehicle_id == vehicle_id:
-                        shipped_tasks.append(work.id)
+        assembly_id = next(iter(self.assembly_dict.values())).id
+        stopover_time = max(end_time) if len(self.vehicle_dict) > 0 else 0
 
-            for deliver_tasks in after_tasks:
-                if deliver_tasks.vehicle_id == vehicle_id:
-                    for task in deliver_tasks.tasks:
-                        if task.work_id is not None: need_tasks.append(task.work_id)
+        swaps: list[VehicleSwaps] = []
 
-            up = list(set(need_tasks) - set(shipped_tasks))
-            down = list(set(shipped_tasks) - set(need_tasks))
+        for vehicle_id in self.vehicle_dict.keys():
+            shipped = set(shipped_tasks[vehicle_id])
+            need = set(need_tasks[vehicle_id])
 
             swaps.append(VehicleSwaps(vehicle_id=vehicle_id,
-                                      assembly_id=next(iter(self.assembly_dict.values())).id,
-                                      stopover_time=0,
-                                      up=up,
-                                      down=down,
+                                      assembly_id=assembly_id,
+                                      stopover_time=stopover_time,
+                                      up=list(need - shipped),
+                                      down=list(shipped - need),
                                       ))
 
-        for swap in swaps:
-            swap.stopover_time = max(end_time)
-
         return End_Response(before_tasks=before_tasks, after_tasks=after_tasks, swaps=swaps)
 
     async def auto_wave2(self):
         vehicle_groups = dict()
         vehicle_works: dict[str, list[Work]] = dict()
-        vty_responses = dict()
 
 
         for vehicle_id, vehicle in self.vehicle_dict.items():
@@ -700,6 +749,8 @@ class OptimizationHandler:
             handling_vehicle_id = vehicle_groups[work.pickup.group_id]
             vehicle_works[handling_vehicle_id].append(work)
 
+        solves: dict[str, Awaitable[dict]] = {}
+
         for _, vehicle in self.vehicle_dict.items():
             vty_jobs = []
             vty_shipments = []
@@ -757,12 +808,18 @@ class OptimizationHandler:
                 }
             }
 
-            status, vty_response = await vroouty.Post(vroouty_request)
-            vty_responses[vehicle.id] = vty_response
-
+            solves[vehicle.id] = self.solve(vroouty_request)
 
-        return vty_responses
+        return await self.solve_vehicles(solves)
     
+    def reserve_indexes(self):
+        # 이후 stage들이 동시에 실행되어도 index가 실행 순서에 따라 달라지지 않도록 미리 할당
+        for work_id in self.work_dict.keys():
+            self.id_handler.pickup_index(work_id)
+
+        for work_id in self.work_dict.keys():
+            self.id_handler.delivery_index(work_id)
+
     async def auto_vehicle_A(self, vehicles_tasks, vehicle_eta):
         work_list = []
         vty_jobs =[]
@@ -799,7 +856,7 @@ class OptimizationHandler:
                     }
                 }
         
-        status, vty_response = await vroouty.Post(vroouty_request)
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
         unassigned = vty_response['unassigned']
 
         return vty_response,unassigned
@@ -848,126 +905,20 @@ class OptimizationHandler:
                     }
                 }
 
-        status, vty_response = await vroouty.Post(vroouty_request)
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
 
         return vty_response
 
     def auto_before_response(self,task_defualt ,task_a, task_bd):
         vehicle_tasks: list[VehicleTasks] = []
 
-        for vehicle in task_a['routes']:
-            tasks: list[Task] = []
-            for step in vehicle['steps']:
-                eta = step['arrival']
-                duration = step['duration']
-                distance = step['distance']
-                setup_time = step['setup']
-                service_time = step['service']
-                location = (step['location'][0], step['location'][1])
-
-                if step['type'] in ['job', 'pickup', 'delivery']:
-                    index_type, work_id = self.id_handler.get_id(step['id'])
-
-                    if index_type in ['pickup', 'shipment_pickup']:
-                        tasks.append(Task(
-                            work_id=work_id,
-                            type=TaskType.pickup,
-                            eta=eta,
-                            duration=duration,
-                            distance=distance,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=None,
-                            location=location,
-                        ))
-
-                    elif index_type in ['delivery', 'shipment_delivery']:
-                        tasks.append(Task(
-                            work_id=work_id,
-                            type=TaskType.delivery,
-                            eta=eta,
-                            duration=duration,
-                            distance=distance,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            location=location,
-                        ))
-                elif step['type'] in ['end']:
-                    for assembly_id, assembly in self.assembly_dict.items():
-                        if assembly.location == location:
-                            tasks.append(Task(
-                                work_id=None,
-                                type=TaskType.arrival,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=assembly_id,
-                                location=location,
-                            ))
-
-
-            vehicle, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
-            vehicle_tasks.append(VehicleTasks(
+        for vehicle in task_a['routes'] + task_bd['routes']:
+            _, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
+            vehicle_tasks.append(VehicleTasks.model_construct(
                 vehicle_id=vehicle_id,
-                tasks=tasks,
+                tasks=self.make_tasks(vehicle),
             ))
-        
-        for vehicle in task_bd['routes']:
-            tasks: list[Task] = []
-            for step in vehicle['steps']:
-                eta = step['arrival']
-                duration = step['duration']
-                distance = step['distance']
-                setup_time = step['setup']
-                service_time = step['service']
-                location = (step['location'][0], step['location'][1])
-
-                if step['type'] in ['job', 'pickup', 'delivery']:
-                    index_type, work_id = self.id_handler.get_id(step['id'])
 
-                    if index_type in ['pickup', 'shipment_pickup']:
-                        tasks.append(Task(
-                            work_id=work_id,
-                            type=TaskType.pickup,
-                            eta=eta,
-                            duration=duration,
-                            distance=distance,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            assembly_id=None,
-                            location=location,
-                        ))
-
-                    elif index_type in ['delivery', 'shipment_delivery']:
-                        tasks.append(Task(
-                            work_id=work_id,
-                            type=TaskType.delivery,
-                            eta=eta,
-                            duration=duration,
-                            distance=distance,
-                            setup_time=setup_time,
-                            service_time=service_time,
-                            location=location,
-                        ))
-                elif step['type'] in ['end']:
-                    for assembly_id, assembly in self.assembly_dict.items():
-                        if assembly.location == location:
-                            tasks.append(Task(
-                                work_id=None,
-                                type=TaskType.arrival,
-                                eta=eta,
-                                setup_time=setup_time,
-                                service_time=service_time,
-                                assembly_id=assembly_id,
-                                location=location,
-                            ))
-
-            vehicle, vehicle_id = self.id_handler.get_id(vehicle['vehicle'])
-            vehicle_tasks.append(VehicleTasks(
-                vehicle_id=vehicle_id,
-                tasks=tasks,
-            ))
-      
         vehicle_tasks.append(task_defualt.vehicle_tasks[2])
 
         return vehicle_tasks
@@ -1001,7 +952,7 @@ class OptimizationHandler:
                     }
                 }
     
-        status, vty_response = await vroouty.Post(vroouty_request)
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
 
         for step in vty_response['routes'][0]['steps']:
             if step['type'] == 'job':
@@ -1038,10 +989,10 @@ class OptimizationHandler:
                     }
         }
         
-        status, vty_response = await vroouty.Post(vroouty_request)
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
         return vty_response
     
-    async def auto_all_wave3(self,v3_tasks):
+    async def auto_all_wave3(self):
         vty_jobs =[]
         vty_shipments =[]
         vty_vehicles = []
@@ -1072,8 +1023,7 @@ class OptimizationHandler:
                     }
                 }
         
-        status, vty_response = await vroouty.Post(vroouty_request)
-        # print(json.dumps(vty_response))
+        status, vty_response = await vroouty.Post(vroouty_request, memo=self.memo)
         etas={}
         for vehicle in vty_response['routes']:
             etas[self.id_handler.get_id(vehicle['vehicle'])[1]]=(vehicle['steps'][-1]['arrival'])
@@ -4,6 +4,7 @@ from enum import Enum
 import random
 
 from dependencies.types import Profile
+from models.v2.jeju_onul.algorithm import Algorithm
 
 import env
 
@@ -159,6 +160,26 @@ class Boundary(BaseModel):
     polygon: list[Coordinates]
 
 
+class WorkTimeRule(BaseModel):
+    duplicated_threshold: int = Field(
+        default=2,
+        ge=1,
+        description='같은 위치의 pickup(delivery)이 이 개수 이상이면 중복 위치로 판단',
+    )
+    duplicated_setup_time: timedelta = Field(
+        default=timedelta(seconds=300),
+        description='중복 위치의 setup time',
+    )
+    setup_time: timedelta = Field(
+        default=timedelta(seconds=180),
+        description='중복되지 않은 위치의 setup time',
+    )
+    service_time: timedelta = Field(
+        default=timedelta(seconds=10),
+        description='service time',
+    )
+
+
 class Request(BaseModel):
     current_time: datetime = Field(
         description='현재 시각',
@@ -172,6 +193,13 @@ class Request(BaseModel):
     vehicles: list[Vehicle] = Field()
     assemblies: list[Assembly] = Field()
     boundaries: list[Boundary] = Field()
+    work_time: WorkTimeRule = Field(
+        default=WorkTimeRule(),
+        description='주문의 pickup, delivery 위치별 setup, service time 규칙',
+    )
+    algorithm: Algorithm = Field(
+        default=Algorithm(),
+    )
 
 class VehicleTasks(BaseModel):
     vehicle_id: str
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 
+from dependencies.cache import caches
+
 import env
 
 router = APIRouter(
@@ -12,3 +14,7 @@ router = APIRouter(
 @router.get('/version')
 def version() -> str:
     return env.VERSION
+
+@router.get('/cache')
+def cache() -> dict[str, dict]:
+    return { name: c.stats() for name, c in caches.items() }
@@ -1,7 +1,13 @@
 from fastapi import APIRouter
 
+import asyncio
+
+from dependencies.log import GetLogger
+from dependencies.response import ModelResponse
+from dependencies.results import ResultCache
 from models.v1.jeju_onul.algorithm import *
 from models.v1.jeju_onul.internal import *
+from models.v1.jeju_onul.session import *
 from models.v1.jeju_onul.transaction import *
 
 router = APIRouter(
@@ -11,14 +17,97 @@ router = APIRouter(
     responses={},
 )
 
+logger = GetLogger('v1')
+
 @router.post('/jeju_onul',
     response_model=Response,
     response_model_exclude_none=True,
 )
 async def jeju_onul(request: Request):
 
+    # current_time은 wave 1 진행 중에만 결과에 영향을 준다
+    exclude = set() if request.current_status == CurrentStatus.wave_1 else {'current_time'}
+    entry = results.get(request.model_dump(mode='json', exclude=exclude))
+
+    if entry.result is not None:
+        return ModelResponse(entry.result)
+
+    if entry.previous is not None and request.algorithm.warm_start:
+        # warm start를 요청했고 일부 work만 바뀐 request는 이전 결과에서 탐색을 시작한다
+        changed = { int(work_id) for work_id in entry.changed }
+        resp, _ = await optimize(request, previous=entry.previous, changed=changed)
+    else:
+        resp, _ = await optimize(request)
+
+    results.set(entry, resp)
+
+    return ModelResponse(resp)
+
+@router.post('/jeju_onul/sessions',
+    response_model=SessionResponse,
+    response_model_exclude_none=True,
+)
+async def create_session(request: Request):
+    """
+    `/jeju_onul`과 같이 최적화하고, 이후 변경분만 받아 다시 계산할 수 있는 session을 생성한다.
+    """
+    session = Session(request)
+
+    async with session.lock:
+        pristine = request.model_copy(deep=True)
+
+        resp, opt = await optimize(request, plans={})
+        session.accept(pristine, resp, opt)
+        sessions.set(session.id, session)
+
+    return ModelResponse(SessionResponse(session_id=session.id, response=session.response))
+
+@router.post('/jeju_onul/sessions/{session_id}',
+    response_model=SessionResponse,
+    response_model_exclude_none=True,
+)
+async def update_session(session_id: str, deltas: Deltas):
+    """
+    session의 마지막 계획(schedules)에 `deltas`를 적용하여 변경된 차량만 다시 계산한다.
+
+    단계별로 차량 조건과 경로상의 주문이 바뀌지 않았고 바뀐 주문을 처리할 수 없는 차량은 마지막 경로를 그대로 사용하고,
+    나머지 차량과 주문만 다시 계산한다. session을 생성할 때의 `algorithm.warm_start`이면 마지막 계획을 초기 경로로 사용한다.
+    """
+    session = GetSession(session_id)
+
+    async with session.lock:
+        request = session.apply(deltas)
+
+        pristine = request.model_copy(deep=True)
+
+        resp, opt = await optimize(request, memo=session.memo, plans=session.plans)
+        session.accept(pristine, resp, opt)
+        sessions.set(session.id, session)
+
+    return ModelResponse(SessionResponse(session_id=session.id, response=session.response))
+
+@router.delete('/jeju_onul/sessions/{session_id}')
+async def delete_session(session_id: str):
+    GetSession(session_id)
+    sessions.delete(session_id)
+
+async def optimize(
+        request: Request,
+        memo: dict[str, bytes] | None = None,
+        previous: Response | None = None,
+        changed: set[int] = set(),
+        plans: dict[tuple, StagePlan] | None = None,
+        ) -> tuple[Response, OptimizationHandler]:
+
     opt = OptimizationHandler(request)
 
+    if memo is not None:
+        opt.memo = memo
+    if previous is not None:
+        opt.use_previous_response(previous, changed)
+    if plans is not None:
+        opt.previous_plans = plans
+
     await opt.first_optimization(request)
 
     best_response, best_stopover_time, best_cost = None, None, 10e20
@@ -35,30 +124,67 @@ async def jeju_onul(request: Request):
     
     elif request.algorithm.second_assembly.type == SecondAssemblyAlgorithmType.select_best:
 
-        for assembly_time in request.algorithm.second_assembly.assembly_time_candidates:
+        best_response, best_stopover_time, best_cost = await select_best(opt, request)
+
+    logger.info('best: %s %s', best_stopover_time, best_cost)
 
-            start = opt.waves.w2.start_time
-            
-            stopover_time = { k: start + assembly_time for k, _ in opt.assembly_dict.items() }
-            print('stopover_time:', stopover_time)
+    if plans is not None:
+        opt.accept_plan(best_stopover_time)
 
-            try:
-                so_response = await opt.second_optimization(request, stopover_time)
+    resp = await opt.make_response(request, best_response, best_stopover_time)
 
-                cost = cost_function(opt, so_response)
-                print('assembly_time:', assembly_time, 'cost:', cost)
+    return resp, opt
 
-                if best_cost > cost:
-                    best_response, best_stopover_time, best_cost = so_response, stopover_time, cost
-            
-            except Exception as e:
-                print('assembly_time:', assembly_time, 'calculation error:', e)
+results = ResultCache('v1_jeju_onul', previous=True)
 
-    print('best:', best_stopover_time, best_cost)
+async def select_best(opt: OptimizationHandler, request: Request) -> tuple[dict | None, dict[int, int] | None, int]:
+    """
+    `assembly_time_candidates`를 `max_concurrency`개씩 동시에 계산하여 cost가 가장 작은 결과를 선택한다.
 
-    resp = await opt.make_response(request, best_response, best_stopover_time)
+    cost가 같으면 candidates 순서상 앞선 결과를 선택한다.
+    """
+    candidates = request.algorithm.second_assembly.assembly_time_candidates
+    semaphore = asyncio.Semaphore(request.algorithm.second_assembly.max_concurrency)
+
+    start = opt.waves.w2.start_time
+
+    async def evaluate(assembly_time: int):
+        stopover_time = { k: start + assembly_time for k, _ in opt.assembly_dict.items() }
+        logger.debug('stopover_time: %s', stopover_time)
+
+        async with semaphore:
+            so_response = await opt.second_optimization(request, stopover_time)
+
+        return stopover_time, so_response, cost_function(opt, so_response)
+
+    tasks = { asyncio.create_task(evaluate(t)): i for i, t in enumerate(candidates) }
+    pending = set(tasks)
+
+    best_response, best_stopover_time, best_cost, best_index = None, None, 10e20, len(candidates)
+
+    try:
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                i = tasks[task]
+                assembly_time = candidates[i]
+
+                try:
+                    stopover_time, so_response, cost = task.result()
+                    logger.debug('assembly_time: %s cost: %s', assembly_time, cost)
+
+                    if (cost, i) < (best_cost, best_index):
+                        best_response, best_stopover_time, best_cost, best_index = so_response, stopover_time, cost, i
+
+                except Exception as e:
+                    logger.warning('assembly_time: %s calculation error: %s', assembly_time, e)
+
+    finally:
+        for t in pending:
+            t.cancel()
 
-    return resp
+    return best_response, best_stopover_time, best_cost
 
 def cost_function(opt: OptimizationHandler, resp) -> int:
     vehicle_count = len(resp['routes'])
@@ -75,6 +201,6 @@ def cost_function(opt: OptimizationHandler, resp) -> int:
             route = routes_dict[vehicle_index]
             distances.append(route['steps'][-1]['distance'])
 
-    print('vc:', vehicle_count, 'distances:', distances)
+    logger.debug('vc: %s distances: %s', vehicle_count, distances)
 
     return int(sum(distances))
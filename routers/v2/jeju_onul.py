@@ -2,6 +2,10 @@ from fastapi import APIRouter
 
 import json
 import asyncio
+from dependencies.concurrency import StageGraph
+from dependencies.log import GetLogger
+from dependencies.response import ModelResponse
+from dependencies.results import Entry, ResultCache
 from models.v2.jeju_onul.internal import OptimizationHandler
 from models.v2.jeju_onul.transaction import *
 
@@ -20,6 +24,15 @@ def add_seconds_to_time(start_time: str, seconds: int) -> str:
     return new_time
 
 
+def get_result(results: ResultCache, request: Request) -> Entry:
+    # current_time은 최적화 결과에 영향을 주지 않는다
+    return results.get(request.model_dump(mode='json', exclude={'current_time'}))
+
+# 바뀐 work와 무관한 차량별 vroouty request는 `vroouty.responses`에서 재사용되므로 이전 결과는 보관하지 않는다
+before_results = ResultCache('v2_jeju_onul_before')
+after_results = ResultCache('v2_jeju_onul_after')
+auto_pilot_results = ResultCache('v2_auto_pilot')
+
 router = APIRouter(
     prefix='',
     tags=['apis'],
@@ -27,16 +40,25 @@ router = APIRouter(
     responses={},
 )
 
+logger = GetLogger('v2')
+
 #메인권역 중심 / cut off 이전
 @router.post('/jeju_onul_before',
     response_model=Start_Response,
     response_model_exclude_none=True,
 )
 async def jeju_onul_beforewave(request: Request):
+    entry = get_result(before_results, request)
+    if entry.result is not None:
+        return ModelResponse(entry.result)
+
     opt = OptimizationHandler(request)
 
     vroouty_responses = await opt.process_opt_wave1()
-    return opt.make_beforewave_response(vroouty_responses)
+    resp = opt.make_beforewave_response(vroouty_responses)
+
+    before_results.set(entry, resp)
+    return ModelResponse(resp)
 
 #cut off 이후부터 집결이후
 @router.post('/jeju_onul_after',
@@ -44,48 +66,73 @@ async def jeju_onul_beforewave(request: Request):
     response_model_exclude_none=True,
 )
 async def jeju_onul_afterwave(request: Request):
-    
+    entry = get_result(after_results, request)
+    if entry.result is not None:
+        return ModelResponse(entry.result)
+
     opt = OptimizationHandler(request)
-    before_tasks = await opt.make_beforetask(await opt.process_opt_wave2())   
-    after_tasks = opt.make_aftertask(await opt.process_opt_wave3())
 
-    return opt.make_afterwave_response(before_tasks,after_tasks)
+    before_tasks, wave3_response = await opt.process_opt_afterwave()
+    after_tasks = opt.make_aftertask(wave3_response)
+
+    resp = opt.make_afterwave_response(before_tasks,after_tasks)
+
+    after_results.set(entry, resp)
+    return ModelResponse(resp)
 
 #auto_pilot_assembly before
 @router.post('/auto_pilot',response_model_exclude=True)
 async def auto_pilot_wave2(request: Request):
-    vehicles_etas = []
+    entry = get_result(auto_pilot_results, request)
+    if entry.result is not None:
+        return ModelResponse(entry.result, exclude_none=False)
+
     opt = OptimizationHandler(request)
-    
-    first_tasks = opt.make_beforewave_response(await opt.auto_wave2())
 
-    for vehicle_tasks in first_tasks.vehicle_tasks:
-        vehicles_etas.append(vehicle_tasks.tasks[-1].eta)
+    async def wave2():
+        first_tasks = opt.make_beforewave_response(await opt.auto_wave2())
+        opt.reserve_indexes()
+        return first_tasks
+
+    def get_vehicles_etas(first_tasks):
+        return [vehicle_tasks.tasks[-1].eta for vehicle_tasks in first_tasks.vehicle_tasks]
 
-    vehicle_A_tasks, unassigned = await opt.auto_vehicle_A(first_tasks,vehicles_etas[2]+4200) #C집결 후 상차 + 공항동까지 소요시간
-    vehicle_B_D_tasks = await opt.auto_vehicle_BD(first_tasks,unassigned)
+    # A → BD 와 C 배송 → v3, all 은 서로 다른 차량과 주문을 다루므로 동시에 계산
+    graph = StageGraph('auto_pilot')
+    graph.add('wave2', wave2)
+    graph.add('A', lambda wave2: opt.auto_vehicle_A(wave2, get_vehicles_etas(wave2)[2]+4200), after=['wave2']) #C집결 후 상차 + 공항동까지 소요시간
+    graph.add('BD', lambda wave2, A: opt.auto_vehicle_BD(wave2, A[1]), after=['wave2', 'A'])
+    graph.add('C', lambda wave2: opt.auto_vehicle_C_assembly_before_delivery(3000+4200), after=['wave2'])
+    graph.add('v3', lambda C: opt.auto_v3_wave3(), after=['C'])
+    graph.add('all', lambda C: opt.auto_all_wave3(), after=['C'])
+
+    results = await graph.run()
+
+    first_tasks = results['wave2']
+    vehicles_etas = get_vehicles_etas(first_tasks)
+    vehicle_A_tasks, unassigned = results['A']
+    vehicle_B_D_tasks = results['BD']
+    v3_tasks = results['v3']
+    all_tasks = results['all']
 
     assembly_1 = add_seconds_to_time('09:00',vehicles_etas[2])
     assembly_2 = add_seconds_to_time(assembly_1,4200)
     assembly_3 = add_seconds_to_time(assembly_2,4200)
     
-    print(f"C 중문동 집결 : {assembly_1}")
-    print(f"A 공항동 집결 : {assembly_2}")
-    print(f"C 중문동 재집결 : {assembly_3}")
+    logger.info('C 중문동 집결 : %s', assembly_1)
+    logger.info('A 공항동 집결 : %s', assembly_2)
+    logger.info('C 중문동 재집결 : %s', assembly_3)
 
 
     auto_pilot_before_tasks = opt.auto_before_response(first_tasks,vehicle_A_tasks,vehicle_B_D_tasks)
 
-    await opt.auto_vehicle_C_assembly_before_delivery(3000+4200)
-
-    v3_tasks = await opt.auto_v3_wave3()
-
-    print(f"C 기사 마감 :{add_seconds_to_time(assembly_3, v3_tasks['routes'][0]['steps'][-1]['arrival']+1800)}")
-    print(f"기사 C : {v3_tasks['routes'][0]['steps'][-1]['arrival']}")
-    all_tasks = await opt.auto_all_wave3(v3_tasks)
-    print(f"중문동 집결 후 출발 시간 : {add_seconds_to_time(assembly_3,1800)}" )
-    print(all_tasks)
+    v3_arrival = v3_tasks['routes'][0]['steps'][-1]['arrival']
+    logger.info('C 기사 마감 :%s', add_seconds_to_time(assembly_3, v3_arrival+1800))
+    logger.info('기사 C : %s', v3_arrival)
+    logger.info('중문동 집결 후 출발 시간 : %s', add_seconds_to_time(assembly_3,1800))
+    logger.debug('%s', all_tasks)
     for vehicle_id ,eta in all_tasks.items():
-        print(f"{vehicle_id} : {add_seconds_to_time(assembly_2,eta+1800)}") # A집결에 상하차(1800sec) 후 바로 배송 시간
+        logger.info('%s : %s', vehicle_id, add_seconds_to_time(assembly_2,eta+1800)) # A집결에 상하차(1800sec) 후 바로 배송 시간
 
-    return first_tasks
\ No newline at end of file
+    auto_pilot_results.set(entry, first_tasks)
+    return ModelResponse(first_tasks, exclude_none=False)